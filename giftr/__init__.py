@@ -3,12 +3,14 @@ application factory
 """
 import os
 
-from flask import Flask, request, jsonify
+import click
+from flask import Flask, request, url_for, stream_with_context
 
 
 from .models import db
-from .exceptions import SetNotFoundError, BadFormatError, DBError
-from . import db_helper
+from .exceptions import SetNotFoundError, BadFormatError, DBError, QueueFullError, InvalidQueryError, \
+    IdempotencyKeyConflictError
+from . import db_helper, help_data, jobs, migrations, json_stream, cache, encoding, registry, age_index
 
 
 def trace():
@@ -26,6 +28,8 @@ def create_app():
     
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.init_app(app)
+    help_data.compile_validators()
+    encoding.init_app(app)
     
     # ensure the instance folder exists
     try:
@@ -33,6 +37,14 @@ def create_app():
     except OSError:
         pass
 
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """
+        Create new tables and bring data of existing ones to the current format
+        """
+        deleted = migrations.upgrade_db()
+        click.echo('Upgraded the database ({} duplicate kinship rows removed).'.format(deleted))
+
     # test interface  - init db
     @app.route('/test',  methods=['POST'])
     def test():
@@ -44,7 +56,13 @@ def create_app():
         if action == 'init':
             db.drop_all()
             db.create_all()
+            # import ids start from the beginning - cached responses are wrong
+            cache.get_cache(app).clear()
+            registry.get_registry(app).clear()
+            age_index.get_store(app).clear()
             return 'Initialized the database.'
+        if action == 'cache_stats':
+            return encoding.json_response(cache.get_cache(app).stats())
         return 'Nothing has been done'
 
     @app.route('/imports', methods=['POST'])
@@ -54,20 +72,57 @@ def create_app():
            
         Returns: 
             response: response containing import id,  201: Created -  if insertion was successful
+            response: response containing job id, 202: Accepted - if insertion was put to the queue (?async=1)
             return_str: error message, 400: Bad Request - if can't make insertion due to some problem with client's data
+            return_str: error message, 409: Conflict - if Idempotency-Key has been already used with another set
+            return_str: error message, 503: Service Unavailable - if there are too many imports in the queue
             return_str: error message, 500: Internal Server Error - if unexpected error occurred during insertion
             (indicator that something is wrong with server)
            
         """
         if request.method == 'POST':
-            request_json = request.get_json()
+            # big sets may be performed in background - client asks about result by job id
+            if request.args.get('async') == '1':
+                request_json = request.get_json()
+                try:
+                    job_id = jobs.submit_import(request_json, request.headers.get('Idempotency-Key'))
+                    response = encoding.json_response({"data": {"job_id": job_id}})
+                    return response, 202, {'Location': url_for('get_import_job', job_id=job_id)}
+                except QueueFullError as e:
+                    return_str = "Insertion failed: {}".format(str(e))
+                    return return_str, 503
+                except DBError as e:
+                    return_str = "Insertion failed: {}".format(str(e))
+                    return return_str, 500
+                except BadFormatError as e:
+                    return_str = "Insertion failed: {}".format(str(e))
+                    return return_str, 400
+                # non-expected exception
+                except Exception as e:
+                    trace()
+                    import traceback
+                    traceback.print_exc()
+                    return_str = "Insertion failed: {}".format(str(e))
+                    return return_str, 500
+
+            # big sets may be parsed and inserted citizen by citizen without reading the whole request
+            stream_mode = request.args.get('stream') == '1' or app.config.get('IMPORT_STREAMING', False)
+            request_json = None if stream_mode else request.get_json()
             try:
-                import_id = db_helper.insert_citizens_set(request_json)
-                response = jsonify({"data": {"import_id": import_id}})
+                # retries of the same request are recognized by idempotency key given by client
+                idempotency_key = request.headers.get('Idempotency-Key')
+                if stream_mode:
+                    import_id = db_helper.insert_citizens_stream(request.stream, idempotency_key)
+                else:
+                    import_id = db_helper.insert_citizens_set(request_json, idempotency_key)
+                response = encoding.json_response({"data": {"import_id": import_id}})
                 return response, 201
             except (BadFormatError, DBError) as e:
                 return_str = "Insertion failed: {}".format(str(e))
                 return return_str, 400
+            except IdempotencyKeyConflictError as e:
+                return_str = "Insertion failed: {}".format(str(e))
+                return return_str, 409
             # non-expected exception
             except Exception as e:
                 trace()
@@ -76,7 +131,40 @@ def create_app():
                 return_str = "Insertion failed: {}".format(str(e))
                 return return_str, 500
 
+    @app.route('/imports/jobs/<int:job_id>')
+    def get_import_job(job_id):
+        """
+        Import job state interface
+           
+        Args:
+            job_id - id of import job
+        
+        Returns: 
+            response: response containing state of job (queued, running, done with import_id or failed with error
+            message),  200: OK -  if query was successful
+            return_str: error message, 404: Not Found - if there is no job with job_id in db
+            return_str: error message, 500: Internal Server Error - if unexpected error occurred during query
+            (indicator that something is wrong with server)
+        """
+        try:
+            res = db_helper.get_import_job(job_id)
+            res = encoding.json_response(res)
+            return res
+        
+        except SetNotFoundError as e:
+            return_str = "Get failed: {}".format(str(e))
+            return return_str, 404
+        
+        # non-expected exception
+        except Exception as e:
+            trace()
+            import traceback
+            traceback.print_exc()
+            return_str = "Get failed: {}".format(str(e))
+            return return_str, 500
+
     @app.route('/imports/<int:import_id>/citizens')
+    @cache.cached()
     def get_citizens(import_id):
         """
         Get citizens set interface
@@ -85,20 +173,64 @@ def create_app():
             import_id - id of citizens' set
         
         Returns: 
-            response: response containing set of citizens,  200: OK -  if query was successful
+            response: response containing set of citizens,  200: OK -  if query was successful (is sent piece by
+            piece in order of citizen_id with ?stream=1, only limit citizens after given citizen_id and citizen_id
+            to get next page after are sent with ?limit=<limit>&after=<citizen_id>, only given fields of citizens are
+            sent with ?fields=<comma separated names>; with Accept: application/x-ndjson citizens are sent piece by
+            piece as json per line (pages too, next page is given by header Link: <url>; rel="next"), with
+            Accept: application/vnd.giftr.columnar+json - as array per field)
             return_str: error message, 404: Not Found - if there are no set of citizens with import_id in db
+            return_str: error message, 400: Bad Request - if limit isn't positive integer, after isn't integer or
+            is given without limit or fields are unknown
             return_str: error message, 500: Internal Server Error - if unexpected error occurred during query
             (indicator that something is wrong with server)
         """
         try:
-            res = db_helper.get_citizens_set(import_id)
-            res = jsonify(res)
+            # big sets may be got page by page
+            limit = help_data.get_positive_int_arg(request.args, 'limit')
+            after = help_data.get_int_arg(request.args, 'after')
+            if after is not None and limit is None:
+                raise (InvalidQueryError("Parameter after is used only with limit"))
+            # only some fields of citizens may be asked
+            fields = help_data.get_fields_arg(request.args)
+            # bulk consumers may ask for citizen per line or array per field
+            output_format = encoding.negotiate_format()
+            if output_format == encoding.NDJSON_MIMETYPE:
+                if limit is None:
+                    citizens = db_helper.iter_citizens_set(import_id, fields)
+                    body = json_stream.iter_ndjson(citizens, encoding.dumps)
+                    return app.response_class(stream_with_context(body), mimetype=output_format)
+                # lines have no place for next page - it is given by Link header (there is no one for the last page)
+                page = db_helper.get_citizens_set(import_id, limit, after, fields)
+                headers = dict()
+                if page["next"] is not None:
+                    next_url = url_for('get_citizens', import_id=import_id, limit=limit, after=page["next"],
+                                       fields=request.args.get('fields'))
+                    headers['Link'] = '<{}>; rel="next"'.format(next_url)
+                body = json_stream.iter_ndjson(page["data"], encoding.dumps)
+                return app.response_class(stream_with_context(body), mimetype=output_format, headers=headers)
+            if output_format == encoding.COLUMNAR_MIMETYPE:
+                res = db_helper.get_citizens_columns(import_id, limit, after, fields)
+                return encoding.json_response(res, mimetype=output_format)
+            if limit is not None:
+                return encoding.json_response(db_helper.get_citizens_set(import_id, limit, after, fields))
+            # big sets may be read and sent citizen by citizen without keeping the whole set in memory
+            if request.args.get('stream') == '1' or app.config.get('EXPORT_STREAMING', False):
+                citizens = db_helper.iter_citizens_set(import_id, fields)
+                body = json_stream.iter_data_json(citizens, encoding.dumps)
+                return app.response_class(stream_with_context(body), mimetype=encoding.MIMETYPE)
+            res = db_helper.get_citizens_set(import_id, fields=fields)
+            res = encoding.json_response(res)
             return res
         
         except SetNotFoundError as e:
             return_str = "Get failed: {}".format(str(e))
             return return_str, 404
         
+        except BadFormatError as e:
+            return_str = "Get failed: {}".format(str(e))
+            return return_str, 400
+        
         # non-expected exception
         except Exception as e:
             trace()
@@ -117,7 +249,8 @@ def create_app():
             citizen_id - citizen to patch
            
         Returns: 
-            response: response containing new information about citizen,  200: OK -  if patch was successfully performed
+            response: response containing new information about citizen (only given fields of it with
+            ?fields=<comma separated names>),  200: OK -  if patch was successfully performed
             return_str: error message, 404: Not Found - if there is no set of citizens with import_id in db,
             or there is not citizen with citizen_id in the set
             return_str: error message, 400: Bad Request - if can't perform patch due to some problem with client's data
@@ -127,8 +260,9 @@ def create_app():
         if request.method == 'PATCH':
             request_json = request.get_json()
             try:
-                res = db_helper.fix_data(import_id, citizen_id, request_json)
-                res = jsonify(res)
+                fields = help_data.get_fields_arg(request.args)
+                res = db_helper.fix_data(import_id, citizen_id, request_json, fields)
+                res = encoding.json_response(res)
                 return res
             
             except SetNotFoundError as e:
@@ -147,6 +281,7 @@ def create_app():
                 return return_str, 500
     
     @app.route('/imports/<int:import_id>/citizens/birthdays')
+    @cache.cached()
     def get_citizens_birthdays(import_id):
         """
         Interface to get information about quantity of presents citizens buy grouped by month
@@ -163,7 +298,7 @@ def create_app():
         """
         try:
             res = db_helper.get_citizens_birthdays_for_import_id(import_id)
-            res = jsonify(res)
+            res = encoding.json_response(res)
             return res
         
         except SetNotFoundError as e:
@@ -178,6 +313,7 @@ def create_app():
             return return_str, 500
     
     @app.route('/imports/<import_id>/towns/stat/percentile/age')
+    @cache.cached(expires=db_helper.get_next_age_change)
     def get_statistic(import_id):
         """
         Interface to get percentiles
@@ -193,7 +329,7 @@ def create_app():
         """
         try:
             res = db_helper.get_statistic_for_import_id(import_id)
-            res = jsonify(res)
+            res = encoding.json_response(res)
             return res
         
         except SetNotFoundError as e:
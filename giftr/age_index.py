@@ -0,0 +1,322 @@
+"""
+In-memory index of birth dates of citizens by towns for age statistics
+
+For every town of set index keeps sorted birth dates (as ordinals), so percentiles of ages are read off them by
+position without any computation over the whole set. Dates of town are kept in sorted blocks of at most
+2 * BLOCK_SIZE dates: patch of citizen's town or birth date finds block of date by bisect over last dates of blocks
+(O(log n)) and removes or inserts the date in this block only, so it shifts no more than one block of dates (not the
+whole town as one sorted array would) and the index isn't rebuilt.
+
+Index is built on the first request of statistics of set and is kept for the version of set it was built for:
+patch performed by the same process brings the index to the new version (moving the date if town or birth date is
+changed), patch performed by other process makes index out of date and it is built again on the next request (index
+built while such patch was committed isn't kept). Every process of the service has its own indexes limited by
+AGE_INDEX_SIZE bytes (0 turns indexes off), least recently used ones are evicted.
+
+Attributes:
+    DEFAULT_SIZE (int): Default memory budget of indexes in bytes
+    TOWN_OVERHEAD (int): Approximate memory taken by town besides its dates in bytes
+    BLOCK_SIZE (int): Number of dates in blocks of town built from distribution (blocks are split when they grow
+        twice as large)
+    BLOCK_OVERHEAD (int): Approximate memory taken by block besides its dates in bytes
+"""
+import datetime
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate
+from collections import OrderedDict
+
+from flask import current_app
+
+from . import help_data, percentiles
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+TOWN_OVERHEAD = 256
+BLOCK_SIZE = 512
+BLOCK_OVERHEAD = 96
+
+# type of array items: ordinals of dates fit 4-byte integers
+_TYPECODE = 'i'
+
+
+def estimate_size(citizens_count):
+    """
+    Returns:
+        (int): approximate memory taken by index of set with citizens_count citizens in bytes (without towns)
+    """
+    return citizens_count * array(_TYPECODE).itemsize
+
+
+class SortedDates:
+    """
+    Sorted ordinals of birth dates of citizens of one town kept in sorted blocks
+    """
+    def __init__(self, ordinals=()):
+        """
+        Args:
+            ordinals (sequence): sorted ordinals of birth dates
+        """
+        self._blocks = [array(_TYPECODE, ordinals[start:start + BLOCK_SIZE])
+                        for start in range(0, len(ordinals), BLOCK_SIZE)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(ordinals)
+        self._starts = None
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, position):
+        # positions of the first dates of blocks are counted again only after changes
+        if self._starts is None:
+            self._starts = list(accumulate([0] + [len(block) for block in self._blocks[:-1]]))
+        block = bisect_right(self._starts, position) - 1
+        return self._blocks[block][position - self._starts[block]]
+
+    @property
+    def size(self):
+        """
+        Returns:
+            (int): approximate memory taken by dates in bytes
+        """
+        return len(self._blocks) * BLOCK_OVERHEAD + self._len * array(_TYPECODE).itemsize
+
+    def add(self, ordinal):
+        """
+        Insert date keeping dates sorted
+        """
+        if not self._blocks:
+            self._blocks.append(array(_TYPECODE))
+            self._maxes.append(ordinal)
+        number = min(bisect_left(self._maxes, ordinal), len(self._blocks) - 1)
+        block = self._blocks[number]
+        insort(block, ordinal)
+        self._maxes[number] = block[-1]
+        if len(block) > 2 * BLOCK_SIZE:
+            self._blocks[number:number + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self._maxes[number:number + 1] = [block[BLOCK_SIZE - 1], block[-1]]
+        self._len += 1
+        self._starts = None
+
+    def remove(self, ordinal):
+        """
+        Remove one occurrence of date
+
+        Raises:
+            KeyError: if there is no such date
+        """
+        # the first block that may contain date contains it if date is there at all
+        number = bisect_left(self._maxes, ordinal)
+        if number == len(self._blocks):
+            raise (KeyError(ordinal))
+        block = self._blocks[number]
+        position = bisect_left(block, ordinal)
+        if block[position] != ordinal:
+            raise (KeyError(ordinal))
+        del block[position]
+        if block:
+            self._maxes[number] = block[-1]
+        else:
+            del self._blocks[number]
+            del self._maxes[number]
+        self._len -= 1
+        self._starts = None
+
+
+class TownAgeIndex:
+    """
+    Sorted birth dates of citizens of every town of one version of set
+    """
+    def __init__(self, version, towns):
+        """
+        Args:
+            version (int): version of set index is built for
+            towns (dict): town -> SortedDates of birth dates of its citizens
+        """
+        self.version = version
+        self.towns = towns
+
+    @classmethod
+    def from_distribution(cls, version, distribution):
+        """
+        Build index from distribution of birth dates in towns
+
+        Args:
+            version (int): version of set
+            distribution (iterable): triples (town, birth_date, number of citizens) ordered by town and birth_date
+
+        Returns:
+            (TownAgeIndex): index of set
+        """
+        towns = dict()
+        for town, birth_date, citizens in distribution:
+            dates = towns.get(town)
+            if dates is None:
+                dates = towns[town] = array(_TYPECODE)
+            dates.extend([birth_date.toordinal()] * citizens)
+        return cls(version, {town: SortedDates(dates) for town, dates in towns.items()})
+
+    @property
+    def size(self):
+        """
+        Returns:
+            (int): approximate memory taken by index in bytes
+        """
+        return sum(TOWN_OVERHEAD + dates.size for dates in self.towns.values())
+
+    def move(self, old_town, old_birth_date, new_town, new_birth_date):
+        """
+        Move citizen to another town or birth date
+
+        Raises:
+            KeyError: if there is no citizen of old_town with old_birth_date in index
+
+        Args:
+            old_town (str): town before patch
+            old_birth_date (datetime.datetime): birth date before patch
+            new_town (str): town after patch
+            new_birth_date (datetime.datetime): birth date after patch
+        """
+        try:
+            dates = self.towns[old_town]
+            dates.remove(old_birth_date.toordinal())
+        except KeyError:
+            raise (KeyError("No citizen of {} born {} in index".format(old_town, old_birth_date)))
+        if not dates:
+            del self.towns[old_town]
+        self.towns.setdefault(new_town, SortedDates()).add(new_birth_date.toordinal())
+
+    def percentiles(self, percents=percentiles.PERCENTS):
+        """
+        Read percentiles of ages off sorted dates (the same way as percentiles.town_percentiles counts them)
+
+        Args:
+            percents (tuple): percentiles to get
+
+        Returns:
+            (list): pairs (town, array of percentiles in order of percents) in order of towns' names
+        """
+        result = list()
+        for town in sorted(self.towns):
+            dates = self.towns[town]
+            last = len(dates) - 1
+            # the latest birth date is the youngest age
+            result.append((town, percentiles.sorted_percentiles(
+                len(dates), lambda position: help_data.get_age(datetime.date.fromordinal(dates[last - position])),
+                percents)))
+        return result
+
+
+class AgeIndexStore:
+    """
+    LRU store of indexes of sets limited by total size of indexes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def percentiles(self, import_id, version):
+        """
+        Read percentiles of ages off index of set
+
+        Args:
+            import_id (int): import id of set
+            version (int): current version of set
+
+        Returns:
+            (list): pairs (town, array of percentiles) in order of towns' names (as TownAgeIndex.percentiles gives)
+            or None if there is no index for this version of set
+        """
+        with self._lock:
+            entry = self._entries.get(import_id)
+            if entry is None or entry[0].version != version:
+                return None
+            self._entries.move_to_end(import_id)
+            return entry[0].percentiles()
+
+    def has(self, import_id):
+        """
+        Returns:
+            (bool): True if there is index of set (of any version)
+        """
+        with self._lock:
+            return import_id in self._entries
+
+    def put(self, import_id, index):
+        """
+        Keep index evicting least recently used ones if budget is exceeded (index larger than the whole budget isn't
+        kept)
+        """
+        size = index.size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(import_id)
+            self._entries[import_id] = (index, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def move(self, import_id, version, old_town, old_birth_date, new_town, new_birth_date):
+        """
+        Apply patch of citizen to index of set: date is moved only if town or birth date is changed, but version of
+        index is advanced by any patch (index of other version than the previous one is forgotten as out of date)
+
+        Args:
+            import_id (int): import id of set
+            version (int): version of set after patch
+            old_town (str): town before patch
+            old_birth_date (datetime.datetime): birth date before patch
+            new_town (str): town after patch
+            new_birth_date (datetime.datetime): birth date after patch
+        """
+        with self._lock:
+            entry = self._entries.get(import_id)
+            if entry is None:
+                return
+            index = entry[0]
+            if index.version != version - 1:
+                self._pop(import_id)
+                return
+            if (old_town, old_birth_date) != (new_town, new_birth_date):
+                try:
+                    index.move(old_town, old_birth_date, new_town, new_birth_date)
+                except KeyError:
+                    # index doesn't match the set - it is built again on the next request
+                    self._pop(import_id)
+                    return
+            index.version = version
+            self.size -= entry[1]
+            self._entries[import_id] = (index, index.size)
+            self.size += index.size
+
+    def _pop(self, import_id):
+        entry = self._entries.pop(import_id, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        """
+        Forget all indexes
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def get_store(app=None):
+    """
+    Get store of indexes of application creating it on first use
+
+    Args:
+        app: flask application (current one if None)
+
+    Returns:
+        (AgeIndexStore): store of application
+    """
+    app = app or current_app
+    if 'age_index' not in app.extensions:
+        app.extensions['age_index'] = AgeIndexStore(app.config.get('AGE_INDEX_SIZE', DEFAULT_SIZE))
+    return app.extensions['age_index']
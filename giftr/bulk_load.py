@@ -0,0 +1,137 @@
+"""
+Bulk loading of rows to tables in the current transaction of session
+
+Loader is chosen by database dialect:
+    -   postgresql (psycopg2): COPY FROM STDIN with rows formed as text in memory buffer
+    -   sqlite (pysqlite): executemany of positional tuples
+    -   other dialects: insert of list of dicts through SQLAlchemy (as it had been done before)
+"""
+import io
+from contextlib import contextmanager
+
+from sqlalchemy import exc
+
+
+def _memoized(process):
+    converted = dict()
+
+    def memoized_process(value):
+        try:
+            return converted[value]
+        except KeyError:
+            result = converted[value] = process(value)
+            return result
+    return memoized_process
+
+
+class DefaultLoader:
+    """
+    Loader that inserts rows as list of dicts through SQLAlchemy core insert
+    """
+    def __init__(self, dialect):
+        self.dialect = dialect
+
+    def load(self, session, model, import_id, rows):
+        """
+        Insert rows to the table of model adding import_id to every row
+
+        Args:
+            session: session which transaction is used for insert
+            model: model class of the table (it has to provide get_keys() in order of values in rows)
+            import_id (int): import id of set rows belong to
+            rows (list): rows of data in order of model.get_keys() without import_id
+        """
+        keys = model.get_keys()
+        dicts = [dict(zip(keys, (import_id,) + tuple(row))) for row in rows]
+        session.execute(model.__table__.insert(), dicts)
+
+    def _processors(self, model):
+        # functions converting python values to db ones for columns in order of model.get_keys() (None if values
+        # are passed as they are)
+        columns = [model.__table__.columns[key] for key in model.get_keys()]
+        return [column.type.dialect_impl(self.dialect).bind_processor(self.dialect) for column in columns]
+
+    @contextmanager
+    def _cursor(self, session, statement):
+        # DBAPI cursor of session's connection - errors of driver are turned to SQLAlchemy ones as if statement has
+        # been executed by SQLAlchemy
+        cursor = session.connection().connection.cursor()
+        try:
+            yield cursor
+        except self.dialect.dbapi.Error as e:
+            raise (exc.DBAPIError.instance(statement, None, e, self.dialect.dbapi.Error, dialect=self.dialect))
+        finally:
+            cursor.close()
+
+    def _quoted_names(self, model):
+        quote = self.dialect.identifier_preparer.quote
+        columns = ", ".join(quote(key) for key in model.get_keys())
+        return quote(model.__table__.name), columns
+
+
+class SQLiteLoader(DefaultLoader):
+    """
+    Loader that inserts positional tuples with executemany of DBAPI cursor
+    """
+    def load(self, session, model, import_id, rows):
+        table, columns = self._quoted_names(model)
+        processors = self._processors(model)
+        statement = "INSERT INTO {} ({}) VALUES ({})".format(table, columns, ", ".join("?" * len(processors)))
+        if any(processors):
+            # import_id is never converted, conversion results are memoized - values repeat a lot (like birth dates)
+            processors = [None if process is None else _memoized(process) for process in processors[1:]]
+            rows = (tuple(value if process is None else process(value) for process, value in zip(processors, row))
+                    for row in rows)
+        with self._cursor(session, statement) as cursor:
+            cursor.executemany(statement, ((import_id,) + tuple(row) for row in rows))
+
+
+class PostgresCopyLoader(DefaultLoader):
+    """
+    Loader that sends rows with COPY FROM STDIN in text format
+    """
+    _escape_table = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+    def _format_value(self, value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, str):
+            return value.translate(self._escape_table)
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return str(value)
+
+    def load(self, session, model, import_id, rows):
+        table, columns = self._quoted_names(model)
+        prefix = "{}\t".format(import_id)
+        format_value = self._format_value
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(prefix)
+            buffer.write("\t".join(map(format_value, row)))
+            buffer.write("\n")
+        buffer.seek(0)
+        statement = "COPY {} ({}) FROM STDIN".format(table, columns)
+        with self._cursor(session, statement) as cursor:
+            cursor.copy_expert(statement, buffer)
+
+
+# loaders for pairs (dialect, DBAPI driver)
+_LOADERS = {
+    ("sqlite", "pysqlite"): SQLiteLoader,
+    ("postgresql", "psycopg2"): PostgresCopyLoader,
+}
+
+
+def get_loader(session):
+    """
+    Get loader suitable for database of session
+
+    Args:
+        session: SQLAlchemy session
+
+    Returns:
+        (DefaultLoader): loader for dialect of session's database
+    """
+    dialect = session.get_bind().dialect
+    return _LOADERS.get((dialect.name, dialect.driver), DefaultLoader)(dialect)
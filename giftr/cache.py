@@ -0,0 +1,242 @@
+"""
+Cache and conditional GET of responses for sets of citizens
+
+Response is kept by (endpoint, import_id, version of set, variant of request). Version of set is increased on every
+patch of it, so responses made before the patch are never returned again and are evicted as least recently used.
+Responses are kept as ready bytes and returned without serialization. Every process of the service has its own cache
+limited by RESPONSE_CACHE_SIZE bytes (0 turns caching off).
+
+Format of response negotiated by Accept and its encoding negotiated by Accept-Encoding are parts of variant - so
+compressed response is kept too and compression is performed once for every version of set.
+
+The same key gives strong ETag of response "<import_id>-<version>-<hash of endpoint and variant>", so request with
+If-None-Match is answered 304 Not Modified knowing only version of set.
+
+Responses that depend on today's date (ages of citizens) are kept with the date they are valid until - the first
+date when age of somebody of citizens changes. Such response is taken from cache until that date (or patch of set),
+that is for days usually, and the date is a part of its ETag.
+
+Attributes:
+    DEFAULT_SIZE (int): Default memory budget of cache in bytes
+"""
+import datetime
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+
+from . import db_helper, encoding, compression, registry
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+
+
+class ResponseCache:
+    """
+    LRU cache of response bodies limited by total size of bodies
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _valid_entry(self, key, today):
+        # entry that isn't out of date (expired ones are evicted)
+        entry = self._entries.get(key)
+        if entry is not None and entry[3] is not None and today >= entry[3]:
+            self._entries.pop(key)
+            self.size -= len(entry[0])
+            return None
+        return entry
+
+    def get(self, key, today=None):
+        """
+        Get cached body
+
+        Args:
+            key (tuple): key of response
+            today (datetime.date): today's date to check if response is out of date (current one if None)
+
+        Returns:
+            body (bytes), mimetype (str), content_encoding (str), valid_until (datetime.date): body of response, its
+            mimetype, encoding (None if it isn't compressed) and the date it is out of date from (None if it doesn't
+            depend on date) or None if it isn't cached
+        """
+        with self._lock:
+            entry = self._valid_entry(key, today or datetime.date.today())
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def valid_until(self, key, today=None):
+        """
+        Get date cached response is out of date from (without counting it as hit or miss)
+
+        Args:
+            key (tuple): key of response
+            today (datetime.date): today's date (current one if None)
+
+        Returns:
+            (datetime.date): the date or None if response isn't cached or doesn't depend on date
+        """
+        with self._lock:
+            entry = self._valid_entry(key, today or datetime.date.today())
+            return entry[3] if entry is not None else None
+
+    def put(self, key, body, mimetype, content_encoding=None, valid_until=None):
+        """
+        Keep body evicting least recently used ones if budget is exceeded (body larger than the whole budget isn't
+        kept)
+
+        Args:
+            key (tuple): key of response
+            body (bytes): body of response
+            mimetype (str): mimetype of response
+            content_encoding (str): encoding of body (None if it isn't compressed)
+            valid_until (datetime.date): date response is out of date from (None if it doesn't depend on date)
+        """
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= len(old_entry[0])
+            self._entries[key] = (body, mimetype, content_encoding, valid_until)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _, _, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        """
+        Forget all responses (counters are kept)
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Returns:
+            (dict): number of hits, misses, entries and their size in bytes
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self.size}
+
+
+def get_cache(app=None):
+    """
+    Get cache of application creating it on first use
+
+    Args:
+        app: flask application (current one if None)
+
+    Returns:
+        (ResponseCache): cache of application
+    """
+    app = app or current_app
+    if 'response_cache' not in app.extensions:
+        app.extensions['response_cache'] = ResponseCache(app.config.get('RESPONSE_CACHE_SIZE', DEFAULT_SIZE))
+    return app.extensions['response_cache']
+
+
+def make_etag(key, valid_until=None):
+    """
+    Make ETag of response
+
+    Args:
+        key (tuple): (endpoint, import_id, version, variant) of response
+        valid_until (datetime.date): date response is out of date from (None if it doesn't depend on date)
+
+    Returns:
+        (str): ETag value (without quotes)
+    """
+    endpoint, import_id, version, variant = key
+    if valid_until is not None:
+        variant += (valid_until.isoformat(),)
+    variant_hash = hashlib.sha256(repr((endpoint, variant)).encode("utf-8")).hexdigest()[:16]
+    return "{}-{}-{}".format(import_id, version, variant_hash)
+
+
+def cached(expires=None):
+    """
+    Decorator for views of set with import_id argument that keeps their successful responses in cache and answers
+    conditional requests
+
+    Successful responses are compressed if client accepts it (streamed ones - piece by piece). Streamed responses
+    aren't cached (but have ETag), responses for ids that aren't integer or sets that don't exist are made by view
+    as they are. Header X-Cache tells if response was taken from cache (HIT) or made by view (MISS).
+
+    Args:
+        expires (function): for responses that depend on today's date (like ages of citizens) - function of
+            (import_id, today) giving the first date response differs from today's one
+    """
+    def decorator(view):
+        @wraps(view)
+        def cached_view(import_id, **kwargs):
+            # nonexistent sets are answered by view without queries
+            found = registry.find(import_id)
+            version = db_helper.get_import_version(found) if found is not None else None
+            if version is None:
+                return view(import_id, **kwargs)
+
+            today = datetime.date.today()
+            variant = tuple(sorted(request.args.items(multi=True)))
+            output_format = encoding.negotiate_format()
+            if output_format != encoding.MIMETYPE:
+                variant += (output_format,)
+            accepted_encoding = compression.negotiate()
+            if accepted_encoding is not None:
+                variant += (accepted_encoding,)
+            key = (request.endpoint, found, version, variant)
+            response_cache = get_cache()
+            valid_until = None
+            if expires is not None:
+                # date response is valid until is kept with cached response - it is looked for once
+                valid_until = response_cache.valid_until(key, today) or expires(found, today)
+            etag = make_etag(key, valid_until)
+            # client has the same version of response - nothing is loaded from db
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                response.vary.update(('Accept', 'Accept-Encoding'))
+                return response
+
+            entry = response_cache.get(key, today) if response_cache.max_bytes > 0 else None
+            if entry is not None:
+                body, mimetype, content_encoding, _ = entry
+                response = current_app.response_class(body, mimetype=mimetype, headers={'X-Cache': 'HIT'})
+                if content_encoding is not None:
+                    response.content_encoding = content_encoding
+            else:
+                response = current_app.make_response(view(import_id, **kwargs))
+                response.headers['X-Cache'] = 'MISS'
+                if response.status_code != 200:
+                    return response
+                if response.is_streamed:
+                    if accepted_encoding is not None:
+                        response.response = compression.compress_stream(
+                            response.response, current_app.config.get('COMPRESSION_LEVEL', 6))
+                        response.content_encoding = accepted_encoding
+                        response.headers.pop('Content-Length', None)
+                else:
+                    body, content_encoding = response.get_data(), None
+                    if accepted_encoding is not None:
+                        body, content_encoding = compression.compress(body)
+                        response.set_data(body)
+                        if content_encoding is not None:
+                            response.content_encoding = content_encoding
+                    if response_cache.max_bytes > 0:
+                        response_cache.put(key, body, response.mimetype, content_encoding, valid_until)
+            response.set_etag(etag)
+            response.vary.update(('Accept', 'Accept-Encoding'))
+            return response
+        return cached_view
+    return decorator
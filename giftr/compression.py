@@ -0,0 +1,59 @@
+"""
+Compression of responses negotiated by Accept-Encoding header
+
+Only gzip is supported. It is turned off by RESPONSE_COMPRESSION = False, responses shorter than
+COMPRESSION_MIN_SIZE bytes (1024 by default) aren't compressed, level of compression is COMPRESSION_LEVEL (6 by
+default).
+"""
+import gzip
+import zlib
+
+from flask import current_app, request
+
+GZIP = "gzip"
+
+
+def negotiate():
+    """
+    Choose encoding of response for current request
+
+    Returns:
+        (str): "gzip" if client accepts it and compression is on or None
+    """
+    if not current_app.config.get('RESPONSE_COMPRESSION', True):
+        return None
+    return GZIP if request.accept_encodings.quality(GZIP) > 0 else None
+
+
+def compress(body):
+    """
+    Compress body of response if it is long enough
+
+    Args:
+        body (bytes): body of response
+
+    Returns:
+        body (bytes), content_encoding (str): compressed body and "gzip" or body as it is and None
+    """
+    if len(body) < current_app.config.get('COMPRESSION_MIN_SIZE', 1024):
+        return body, None
+    return gzip.compress(body, compresslevel=current_app.config.get('COMPRESSION_LEVEL', 6)), GZIP
+
+
+def compress_stream(chunks, level=6):
+    """
+    Compress body of streamed response piece by piece
+
+    Args:
+        chunks (iterable): pieces of body (bytes)
+        level (int): level of compression
+
+    Yields:
+        (bytes): pieces of gzip stream
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
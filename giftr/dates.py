@@ -0,0 +1,103 @@
+"""
+Conversion of dates from "ДД.ММ.ГГГГ" format of api to datetime suitable for db and back
+
+Birth dates repeat a lot in big sets of citizens, so results of conversion are memoized
+
+Attributes:
+    DATE_CACHE_SIZE (int): Maximum number of different date strings which conversion results are kept
+"""
+import datetime
+from functools import lru_cache
+
+from .exceptions import BadDateFormatError
+
+DATE_CACHE_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date):
+    """
+    Convert date string of strict "ДД.ММ.ГГГГ" format to datetime
+
+    Args:
+        date(str): date in original format that should be "ДД.ММ.ГГГГ"
+
+    Returns:
+        (datetime.datetime): date suitable for db
+
+    Raises: BadDateFormatError: if date string isn't of "ДД.ММ.ГГГГ" format (including whitespace characters anywhere
+    in the string) or if date is not valid
+    """
+    if (len(date) != 10 or date[2] != "." or date[5] != "."
+            or not (date[:2] + date[3:5] + date[6:]).isdigit() or not date.isascii()):
+        raise (BadDateFormatError("String {} is not of ДД.ММ.ГГГГ format".format(date)))
+    try:
+        return datetime.datetime(int(date[6:]), int(date[3:5]), int(date[:2]))
+    except ValueError:
+        raise (BadDateFormatError("String {} is not valid date".format(date)))
+
+
+def parse_dates(dates):
+    """
+    Convert the whole column of date strings of "ДД.ММ.ГГГГ" format to datetimes
+
+    Args:
+        dates(iterable): dates in original format that should be "ДД.ММ.ГГГГ"
+
+    Returns:
+        (list): datetimes in the same order
+
+    Raises: BadDateFormatError: for the first date string that isn't of "ДД.ММ.ГГГГ" format or is not valid date
+    """
+    converted = dict()
+    result = list()
+    for date in dates:
+        db_date = converted.get(date)
+        if db_date is None:
+            db_date = converted[date] = parse_date(date)
+        result.append(db_date)
+    return result
+
+
+def format_date(date):
+    """
+    Convert date to "ДД.ММ.ГГГГ" format
+
+    Args:
+        date(datetime.date): date from db
+
+    Returns:
+        (str): date in "ДД.ММ.ГГГГ" format
+    """
+    return "%02d.%02d.%d" % (date.day, date.month, date.year)
+
+
+def date_formatter():
+    """
+    Make function converting dates to "ДД.ММ.ГГГГ" format that memoizes its results (for one set of citizens)
+
+    Returns:
+        (function): function taking date and returning string
+    """
+    formatted = dict()
+
+    def format_memoized(date):
+        try:
+            return formatted[date]
+        except KeyError:
+            result = formatted[date] = format_date(date)
+            return result
+    return format_memoized
+
+
+def format_dates(dates):
+    """
+    Convert the whole column of dates to "ДД.ММ.ГГГГ" format
+
+    Args:
+        dates(iterable): dates from db
+
+    Returns:
+        (list): date strings in the same order
+    """
+    return list(map(date_formatter(), dates))
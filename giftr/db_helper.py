@@ -1,15 +1,17 @@
 """
 interaction with db through FLask-SQLAlchemy
 """
+import time
+import datetime
+
 from flask import current_app
-from sqlalchemy import extract
+from sqlalchemy import extract, select, and_, union_all, literal, cast, Date, Float
 from sqlalchemy import exc
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array, ARRAY
 
-from numpy import percentile
-
-from .models import db, Citizens, Imports, Kinships
-from .exceptions import SetNotFoundError, DBError
-from . import help_data
+from .models import db, Citizens, Imports, Kinships, ImportJobs, PresentCounts, TownBirthDates
+from .exceptions import SetNotFoundError, BadFormatError, DBError, IdempotencyKeyConflictError
+from . import help_data, json_stream, bulk_load, dates, registry, percentiles, age_index
 
 
 def trace():
@@ -18,18 +20,24 @@ def trace():
     print('>>>>> TRACE: {}:{}'.format(getframeinfo(cf).filename, cf.f_back.f_lineno))
 
 
-def insert_citizens_set(request_json):
+def insert_citizens_set(request_json, idempotency_key=None):
     """ 
     Insert set of citizens data to db
     
+    If set with the same idempotency key has been already inserted (or with the same content if
+    IMPORT_DEDUPLICATION is on) nothing is inserted and import_id of existing set is returned. Idempotency key
+    that has been already used with another set isn't accepted.
+    
     Args:
         request_json (dict): data about citizens to insert
+        idempotency_key (str): key given by client to recognize retries of the same request
     
     Returns:
         import_id (int):  import_id if insert is successfully completed
     
     Raises:
         InvalidJSONError: if request_json is not valid json or values of request_json are not of valid types
+        IdempotencyKeyConflictError: if set with the same idempotency key and another content has been inserted
         exc.SQLAlchemyError: if something get wrong during work with db
         InconsistentRelativesError: if relatives are inconsistent
         NonUniqueRelativeError: if relatives for one citizens are not unique
@@ -41,40 +49,472 @@ def insert_citizens_set(request_json):
 
     # parse json and get data to insert to db
     citizens_data, kinships_data = help_data.get_insert_data(request_json)
-    citizen_len = len(citizens_data)
     kinship_len = len(kinships_data)
 
-    import_obj = Imports()
+    # retry of request that has been already performed
+    deduplication = current_app.config.get('IMPORT_DEDUPLICATION', False)
+    content_hash = None
+    if idempotency_key is not None or deduplication:
+        content_hash = help_data.get_content_hash(request_json["citizens"])
+    import_id = find_retried_import(idempotency_key, content_hash)
+    if import_id is not None:
+        return import_id
+
+    # the same set has been already inserted
+    if deduplication:
+        import_id = find_existing_import(content_hash=content_hash)
+        if import_id is not None:
+            return import_id
+
+    import_obj = Imports(citizens_count=len(citizens_data), content_hash=content_hash if deduplication else None,
+                         idempotency_key=idempotency_key, request_hash=content_hash)
     try:
         # get unique import number import_id
         db.session.add(import_obj)
         db.session.flush()
         import_id = import_obj.import_id
         # add import_id to citizens data and insert citizens' data to db
-        citizen_data_with_import_id = list(map(list.__add__, [[import_id]] * citizen_len, citizens_data))
-        citizens_dicts = [dict(zip(Citizens.get_keys(), sublist)) for sublist in citizen_data_with_import_id]
-        db.session.execute(Citizens.__table__.insert(), citizens_dicts)
+        insert_rows(Citizens, import_id, citizens_data)
 
         # do the same with kinships' data if there is at least one relativw connection for set
         if kinship_len > 0:
-            kinship_data_with_import_id = list(map(list.__add__, [[import_id]] * kinship_len, kinships_data))
-            kinship_dicts = [dict(zip(Kinships.get_keys(), sublist)) for sublist in kinship_data_with_import_id]
-            db.session.execute(Kinships.__table__.insert(), kinship_dicts)
+            insert_rows(Kinships, import_id, kinships_data)
+        refresh_aggregates(import_id)
+        db.session.commit()
+        registry.get_registry().add(import_id, import_obj.citizens_count)
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        # concurrent retry with the same idempotency key has been inserted first
+        import_id = find_retried_import(idempotency_key, content_hash)
+        if import_id is not None:
+            return import_id
+        current_app.logger.info("Error during insertion")
+        raise (DBError("Error during insertion"))
+
+    return import_id
+
+
+def insert_citizens_stream(stream, idempotency_key=None):
+    """
+    Insert set of citizens data that comes as a stream to db
+    
+    Citizens are parsed, validated and inserted in batches of IMPORT_STREAM_BATCH_SIZE citizens one by one as they
+    come, so memory consumption doesn't depend on size of the set. All batches are inserted in one transaction
+    which is rolled back if something is wrong with any of citizens. Retries are recognized the same way as
+    insert_citizens_set does (content of the set is known only in the end, so the transaction is rolled back then,
+    set of request with already used idempotency key is read through without insertion to check its content).
+    
+    Args:
+        stream: file-like object containing citizens set json as utf-8 encoded bytes
+        idempotency_key (str): key given by client to recognize retries of the same request
+    
+    Returns:
+        import_id (int):  import_id if insert is successfully completed
+    
+    Raises:
+        InvalidJSONError: if stream is not valid json or values of json are not of valid types
+        IdempotencyKeyConflictError: if set with the same idempotency key and another content has been inserted
+        DBError: if something get wrong during work with db
+        InconsistentRelativesError: if relatives are inconsistent
+        NonUniqueRelativeError: if relatives for one citizens are not unique
+        BadDateFormatError: if date string isn't of "ДД.ММ.ГГГГ" format or have whitespace characters in the beginning
+        or the end of the string or if date is not valid
+    """
+    batch_size = current_app.config.get('IMPORT_STREAM_BATCH_SIZE', 1000)
+    deduplication = current_app.config.get('IMPORT_DEDUPLICATION', False)
+    content_hash = help_data.ContentHash() if idempotency_key is not None or deduplication else None
+    citizens = help_data.iter_insert_data(json_stream.iter_citizens(stream), content_hash)
+
+    # retry of request that has been already performed - set is only read to check it is the same
+    if find_existing_import(idempotency_key=idempotency_key) is not None:
+        for _ in citizens:
+            pass
+        return find_retried_import(idempotency_key, content_hash.hexdigest())
+
+    import_obj = Imports(idempotency_key=idempotency_key)
+    try:
+        db.session.add(import_obj)
+        db.session.flush()
+        import_id = import_obj.import_id
+        citizens_batch = list()
+        kinships_batch = list()
+        citizens_count = 0
+        for citizen_data, kinships_data in citizens:
+            citizens_count += 1
+            citizens_batch.append(citizen_data)
+            kinships_batch.extend(kinships_data)
+            if len(citizens_batch) >= batch_size:
+                insert_rows(Citizens, import_id, citizens_batch)
+                citizens_batch.clear()
+            if len(kinships_batch) >= batch_size:
+                insert_rows(Kinships, import_id, kinships_batch)
+                kinships_batch.clear()
+        if citizens_batch:
+            insert_rows(Citizens, import_id, citizens_batch)
+        if kinships_batch:
+            insert_rows(Kinships, import_id, kinships_batch)
+        if deduplication:
+            existing_import_id = find_existing_import(content_hash=content_hash.hexdigest())
+            if existing_import_id is not None:
+                db.session.rollback()
+                return existing_import_id
+            import_obj.content_hash = content_hash.hexdigest()
+        if content_hash is not None:
+            import_obj.request_hash = content_hash.hexdigest()
+        import_obj.citizens_count = citizens_count
+        refresh_aggregates(import_id)
         db.session.commit()
+        registry.get_registry().add(import_id, citizens_count)
+    except BadFormatError:
+        db.session.rollback()
+        raise
     except exc.SQLAlchemyError:
         db.session.rollback()
+        # concurrent retry with the same idempotency key has been inserted first - the rest of set is read to check it
+        if find_existing_import(idempotency_key=idempotency_key) is not None:
+            for _ in citizens:
+                pass
+            return find_retried_import(idempotency_key, content_hash.hexdigest())
         current_app.logger.info("Error during insertion")
         raise (DBError("Error during insertion"))
 
     return import_id
 
 
-def get_citizens_set(import_id_):
+def find_retried_import(idempotency_key, content_hash):
+    """
+    Find import that has been inserted with given idempotency key and check that its request has had the same set
+    
+    Args:
+        idempotency_key (str): key given by client with insert request
+        content_hash (str): hash of content of citizens set of the request (see help_data.get_content_hash)
+    
+    Returns:
+        import_id (int): import_id of found import or None if there is no such import (or idempotency_key is None)
+    
+    Raises:
+        IdempotencyKeyConflictError: if import with this key has been inserted with another set
+    """
+    if idempotency_key is None:
+        return None
+    import_obj = Imports.query.filter_by(idempotency_key=idempotency_key).first()
+    if import_obj is None:
+        return None
+    # imports inserted before request hashes were saved are accepted as retries as they used to be
+    if import_obj.request_hash is not None and import_obj.request_hash != content_hash:
+        current_app.logger.info("Idempotency key has been used with another set")
+        raise (IdempotencyKeyConflictError("Idempotency key has been used with another set"))
+    return import_obj.import_id
+
+
+def find_existing_import(idempotency_key=None, content_hash=None):
+    """
+    Find import that has been inserted with given idempotency key or has given content hash
+    
+    Args:
+        idempotency_key (str): key given by client with insert request
+        content_hash (str): hash of content of citizens set (see help_data.get_content_hash)
+    
+    Returns:
+        import_id (int): import_id of found import or None if there is no such import (or both args are None)
+    """
+    if idempotency_key is not None:
+        import_obj = Imports.query.filter_by(idempotency_key=idempotency_key).first()
+    elif content_hash is not None:
+        import_obj = Imports.query.filter_by(content_hash=content_hash).first()
+    else:
+        return None
+    return import_obj.import_id if import_obj else None
+
+
+def insert_rows(model, import_id, rows):
+    """
+    Insert rows of data to the table of model adding import_id to every row with loader suitable for db dialect
+    
+    If IMPORT_BATCH_SIZE is set rows are sent in chunks of this size (all of them in the current transaction),
+    time of insertion of every chunk is logged.
+    
+    Args:
+        model: model class of the table (Citizens or Kinships)
+        import_id (int): import id of set rows belong to
+        rows (list): rows of data in order of model.get_keys() without import_id
+    
+    Returns:
+        timings (list): seconds spent on insertion of every chunk
+    """
+    loader = bulk_load.get_loader(db.session)
+    batch_size = current_app.config.get('IMPORT_BATCH_SIZE') or len(rows) or 1
+    table = model.__table__.name
+    timings = list()
+    for chunk_number, start in enumerate(range(0, len(rows), batch_size), 1):
+        chunk = rows[start:start + batch_size]
+        start_time = time.perf_counter()
+        loader.load(db.session, model, import_id, chunk)
+        timings.append(time.perf_counter() - start_time)
+        current_app.logger.info("import {}: {} chunk {}: {} rows inserted in {:.4f}s".format(
+            import_id, table, chunk_number, len(chunk), timings[-1]))
+    return timings
+
+
+def refresh_present_counts(import_id_, givers=None):
+    """
+    Recompute number of presents every citizen buys in every month and save them to present_counts table
+    
+    Args:
+        import_id_ (int): import id of set
+        givers (iterable): if given only counts of these citizens are recomputed (otherwise set has to have no counts
+        yet)
+    """
+    if givers is not None:
+        givers = list(givers)
+        PresentCounts.query.filter(PresentCounts.import_id == import_id_, PresentCounts.citizen_id.in_(givers)) \
+            .delete(synchronize_session=False)
+    pairs = kinship_pairs(import_id_)
+    month = extract('month', Citizens.birth_date)
+    counts = (select([literal(import_id_), pairs.c.citizen_id, month, db.func.count()])
+              .select_from(pairs.join(Citizens, and_(Citizens.import_id == import_id_,
+                                                     Citizens.citizen_id == pairs.c.relative_id)))
+              .group_by(pairs.c.citizen_id, month))
+    if givers is not None:
+        counts = counts.where(pairs.c.citizen_id.in_(givers))
+    db.session.execute(PresentCounts.__table__.insert().from_select(
+        ['import_id', 'citizen_id', 'month', 'presents'], counts))
+
+
+def refresh_town_birth_dates(import_id_, towns=None):
+    """
+    Recompute number of citizens of every town born in every date and save them to town_birth_dates table
+    
+    Args:
+        import_id_ (int): import id of set
+        towns (iterable): if given only distributions of these towns are recomputed (otherwise set has to have no
+        distributions yet)
+    """
+    if towns is not None:
+        towns = list(towns)
+        TownBirthDates.query.filter(TownBirthDates.import_id == import_id_, TownBirthDates.town.in_(towns)) \
+            .delete(synchronize_session=False)
+    distribution = (select([literal(import_id_), Citizens.town, Citizens.birth_date, db.func.count()])
+                    .where(Citizens.import_id == import_id_)
+                    .group_by(Citizens.town, Citizens.birth_date))
+    if towns is not None:
+        distribution = distribution.where(Citizens.town.in_(towns))
+    db.session.execute(TownBirthDates.__table__.insert().from_select(
+        ['import_id', 'town', 'birth_date', 'citizens'], distribution))
+
+
+def refresh_aggregates(import_id_):
+    """
+    Compute all aggregates for just inserted set in the current transaction
+    
+    Args:
+        import_id_ (int): import id of set
+    """
+    start_time = time.perf_counter()
+    refresh_present_counts(import_id_)
+    refresh_town_birth_dates(import_id_)
+    current_app.logger.info("import {}: aggregates computed in {:.4f}s".format(
+        import_id_, time.perf_counter() - start_time))
+
+
+def create_import_job():
+    """
+    Register new import job in queued state
+    
+    Returns:
+        job_id (int): id of new job
+    
+    Raises:
+        DBError: if something get wrong during work with db
+    """
+    job = ImportJobs(status='queued')
+    try:
+        db.session.add(job)
+        db.session.commit()
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.info("Error during creation of import job")
+        raise (DBError("Error during creation of import job"))
+    return job.job_id
+
+
+def update_import_job(job_id, status, import_id=None, error=None):
+    """
+    Change state of import job
+    
+    Args:
+        job_id (int): id of job
+        status (str): new status - 'queued', 'running', 'done' or 'failed'
+        import_id (int): import_id of inserted set for done job
+        error (str): error message for failed job
+    
+    Raises:
+        DBError: if something get wrong during work with db
+    """
+    try:
+        ImportJobs.query.filter_by(job_id=job_id).update({'status': status, 'import_id': import_id, 'error': error})
+        db.session.commit()
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.info("Error during update of import job {}".format(job_id))
+        raise (DBError("Error during update of import job {}".format(job_id)))
+
+
+def get_import_job(job_id):
+    """
+    Get state of import job
+    
+    Args:
+        job_id (int): id of job
+    
+    Returns:
+        dict: state of job
+        
+    Raises:
+        SetNotFoundError: if there is no job with job_id
+    """
+    job = ImportJobs.query.filter_by(job_id=job_id).first()
+    if not job:
+        current_app.logger.info("import job with job_id = {} does not exist".format(job_id))
+        raise (SetNotFoundError("import job with job_id = {} does not exist".format(job_id)))
+    return {"data": job.serialize()}
+
+
+def get_import_version(import_id_):
+    """
+    Get version of set - it is increased on every change of set
+    
+    Args:
+        import_id_ (int): import id of set
+    
+    Returns:
+        version (int): version of set or None if there is no set with import_id
+    """
+    return db.session.execute(select([Imports.version]).where(Imports.import_id == import_id_)).scalar()
+
+
+def kinship_pairs(import_id_, citizen_id_=None, citizens_range=None):
+    """
+    Make selectable of relative pairs in both directions - kinships table keeps every pair once
+    
+    Args:
+        import_id_ (int): import id of set
+        citizen_id_ (int): if given only relatives of this citizen are selected
+        citizens_range (tuple): if given only relatives of citizens with ids from first to last (inclusive) of pair
+        are selected
+    
+    Returns:
+        selectable with columns citizen_id and relative_id that contains (a, b) and (b, a) for every pair of
+        relatives a != b and (a, a) for relation to self
+    """
+    forward = select([Kinships.citizen_id.label('citizen_id'), Kinships.relative_id.label('relative_id')]) \
+        .where(Kinships.import_id == import_id_)
+    backward = select([Kinships.relative_id.label('citizen_id'), Kinships.citizen_id.label('relative_id')]) \
+        .where(and_(Kinships.import_id == import_id_, Kinships.citizen_id != Kinships.relative_id))
+    if citizen_id_ is not None:
+        forward = forward.where(Kinships.citizen_id == citizen_id_)
+        backward = backward.where(Kinships.relative_id == citizen_id_)
+    if citizens_range is not None:
+        forward = forward.where(Kinships.citizen_id.between(*citizens_range))
+        backward = backward.where(Kinships.relative_id.between(*citizens_range))
+    return union_all(forward, backward).alias('kinship_pairs')
+
+
+# fields of citizen in response (except relatives)
+CITIZEN_KEYS = Citizens.get_keys()[1:]
+
+
+class Projection:
+    """
+    Fields of citizens to get - only their columns are selected and only they are put to response
+    
+    citizen_id is always selected (citizens are ordered and merged with relatives by it) but is put to response
+    only if it is asked. Relatives aren't got at all if they aren't asked.
+    """
+    def __init__(self, fields=None):
+        self.fields = fields
+        self.keys = tuple(key for key in CITIZEN_KEYS if fields is None or key in fields or key == 'citizen_id')
+        self.columns = [Citizens.__table__.c[key] for key in self.keys]
+        self.relatives = fields is None or 'relatives' in fields
+        # birth dates repeat a lot - every one is formatted once
+        self.format_date = dates.date_formatter()
+
+    def citizen_data(self, row, relatives=None):
+        """
+        Make citizen's information from row of selected columns (relatives are empty if they are asked but aren't
+        given)
+        """
+        citizen_data = dict(zip(self.keys, row))
+        if 'birth_date' in citizen_data:
+            citizen_data['birth_date'] = self.format_date(citizen_data['birth_date'])
+        if self.relatives:
+            citizen_data['relatives'] = list() if relatives is None else relatives
+        return citizen_data
+
+    def project(self, citizen_data):
+        """
+        Leave only asked fields in citizen's information
+        """
+        if self.fields is None:
+            return citizen_data
+        return {key: value for key, value in citizen_data.items() if key in self.fields}
+
+
+def _parse_group_concat(value):
+    # group_concat gives comma separated ids or NULL if citizen has no relatives
+    return sorted(map(int, value.split(","))) if value else []
+
+
+def _parse_array_agg(value):
+    # citizen without relatives has no row in aggregate, so outer join gives NULL
+    if value is None:
+        return []
+    return [relative_id for relative_id in value if relative_id is not None]
+
+
+def relatives_aggregate(dialect_name, relative_id):
+    """
+    Make aggregate function that collects relatives of citizen in one value suitable for dialect
+    
+    Args:
+        dialect_name (str): name of db dialect
+        relative_id: column of relative ids to aggregate
+    
+    Returns:
+        aggregate (column expression), parse (function): aggregate and function that turns its value to sorted
+        list of relatives or (None, None) if dialect has no suitable aggregate
+    """
+    if dialect_name == 'postgresql':
+        return db.func.array_agg(aggregate_order_by(relative_id, relative_id)), _parse_array_agg
+    if dialect_name == 'sqlite':
+        return db.func.group_concat(relative_id), _parse_group_concat
+    return None, None
+
+
+def _check_set_exists(import_id_):
+    # known sets are checked by registry without queries, only sets inserted by previous versions (of unknown size)
+    # are looked for in citizens table
+    import_id_ = registry.check_exists(import_id_)
+    if registry.get_registry().citizens_count(import_id_) is None and not db.session.execute(
+            select([Citizens.citizen_id]).where(Citizens.import_id == import_id_).limit(1)).first():
+        current_app.logger.info("import with import_id = {} does not exist".format(import_id_))
+        raise (SetNotFoundError("import with import_id = {} does not exist".format(import_id_)))
+    return import_id_
+
+
+def get_citizens_set(import_id_, limit=None, after=None, fields=None):
     """
     Get set of citizens with certain import_id
     
+    Citizens are got in order of citizen_id with sorted relatives. Relatives are aggregated by db in the same query
+    (array_agg for postgresql, group_concat for sqlite), for other dialects they are got by separate query.
+    If limit is given only one page of set is got (see get_citizens_page).
+    
     Args:
         import_id_ (int): import id of set to get
+        limit (int): max number of citizens to get
+        after (int): citizen_id after which page starts (from the beginning of set if None)
+        fields (tuple): fields of citizens to get (all of them if None)
     
     Returns:
         dict: information about citizens of set with import_id
@@ -82,25 +522,213 @@ def get_citizens_set(import_id_):
     Raises:       
         SetNotFoundError:  if set with import_id doesn't exist in db
     """
-    # get citizens' set with id import_id_ info
-    citizens_responce = Citizens.query.filter_by(import_id=import_id_).all()
-    # responce souldn't be empty - raise exception
-    if not citizens_responce:
-        current_app.logger.info("import with import_id = {} does not exist".format(import_id_))
-        raise (SetNotFoundError("import with import_id = {} does not exist".format(import_id_)))
-    # create responce for client without relative connections
-    citizens_dict = {citizen.citizen_id: citizen.serialize() for citizen in citizens_responce}
-    # get information  about relatives
-    kinship_response = Kinships.query.filter_by(import_id=import_id_).all()
-    # add relative connections to response
-    for kinship in kinship_response:
-        citizen_id = kinship.citizen_id
-        relative_id = kinship.relative_id
-        citizens_dict[citizen_id]["relatives"].append(relative_id)
-    return {"data": list(citizens_dict.values())}
+    if limit is not None:
+        return get_citizens_page(import_id_, limit, after, fields)
+    _check_set_exists(import_id_)
+    projection = Projection(fields)
+    query = select(projection.columns).where(Citizens.import_id == import_id_).order_by(Citizens.citizen_id)
+    parse = None
+    if projection.relatives:
+        pairs = kinship_pairs(import_id_)
+        aggregate, parse = relatives_aggregate(db.session.get_bind().dialect.name, pairs.c.relative_id)
+        if aggregate is None:
+            return {"data": list(iter_citizens_set(import_id_, fields))}
+        # relative connections are got in the same query
+        relatives = (select([pairs.c.citizen_id, aggregate.label('relatives')])
+                     .group_by(pairs.c.citizen_id)
+                     .alias('relatives'))
+        query = (query.column(relatives.c.relatives)
+                 .select_from(Citizens.__table__.outerjoin(relatives, relatives.c.citizen_id == Citizens.citizen_id)))
+
+    # get citizens' set with id import_id_ info (rows without ORM objects)
+    citizens_responce = db.session.execute(query).fetchall()
+    data = list()
+    for row in citizens_responce:
+        citizen_data = projection.citizen_data(row)
+        if parse is not None:
+            citizen_data["relatives"] = parse(row[-1])
+        data.append(projection.project(citizen_data))
+    return {"data": data}
+
+
+def get_citizens_page(import_id_, limit, after=None, fields=None):
+    """
+    Get page of set of citizens with certain import_id
+    
+    Page is found by primary key (import_id, citizen_id) - without offset, so every page costs the same. Only
+    relatives of citizens of the page are got.
+    
+    Args:
+        import_id_ (int): import id of set to get
+        limit (int): max number of citizens on page
+        after (int): citizen_id after which page starts (from the beginning of set if None)
+        fields (tuple): fields of citizens to get (all of them if None)
+    
+    Returns:
+        dict: information about citizens of page in order of citizen_id with sorted relatives and citizen_id to
+        get the next page after ("next" is None for the last page)
+        
+    Raises:       
+        SetNotFoundError:  if set with import_id doesn't exist in db
+    """
+    _check_set_exists(import_id_)
+    projection = Projection(fields)
+    query = select(projection.columns).where(Citizens.import_id == import_id_)
+    if after is not None:
+        query = query.where(Citizens.citizen_id > after)
+    citizens_responce = db.session.execute(query.order_by(Citizens.citizen_id).limit(limit)).fetchall()
+
+    citizens_dict = dict()
+    for row in citizens_responce:
+        citizen_data = projection.citizen_data(row)
+        citizens_dict[citizen_data["citizen_id"]] = citizen_data
+    if citizens_responce and projection.relatives:
+        pairs = kinship_pairs(import_id_, citizens_range=(citizens_responce[0].citizen_id,
+                                                          citizens_responce[-1].citizen_id))
+        kinship_response = db.session.execute(select([pairs.c.citizen_id, pairs.c.relative_id])
+                                              .order_by(pairs.c.citizen_id, pairs.c.relative_id))
+        for citizen_id, relative_id in kinship_response:
+            citizens_dict[citizen_id]["relatives"].append(relative_id)
+
+    next_after = citizens_responce[-1].citizen_id if len(citizens_responce) == limit else None
+    return {"data": [projection.project(citizen_data) for citizen_data in citizens_dict.values()],
+            "next": next_after}
+
+
+def iter_citizens_set(import_id_, fields=None):
+    """
+    Get set of citizens with certain import_id citizen by citizen
+    
+    Citizens are read in order of citizen_id with server-side cursor in batches of EXPORT_STREAM_BATCH_SIZE rows,
+    relatives are merged from the second cursor sorted the same way - so only one batch of each is kept in memory.
+    Existence of set is checked before the first citizen is read.
+    
+    Args:
+        import_id_ (int): import id of set to get
+        fields (tuple): fields of citizens to get (all of them if None)
+    
+    Returns:
+        (generator): information about citizens of set with import_id (dicts as in get_citizens_set) in order of
+        citizen_id, relatives of every citizen are sorted
+        
+    Raises:       
+        SetNotFoundError:  if set with import_id doesn't exist in db
+    """
+    projection, rows = iter_citizens_rows(import_id_, fields)
+    return (projection.project(projection.citizen_data(row, relatives)) for row, relatives in rows)
 
 
-def fix_data(import_id_, citizen_id_, request_json):
+def iter_citizens_rows(import_id_, fields=None):
+    """
+    Get set of citizens with certain import_id as rows of columns citizen by citizen (the same way as
+    iter_citizens_set)
+    
+    Args:
+        import_id_ (int): import id of set to get
+        fields (tuple): fields of citizens to get (all of them if None)
+    
+    Returns:
+        projection (Projection): selected columns (projection.keys) and fields
+        rows (generator): pairs (row of selected columns, sorted list of relatives or None if they aren't asked)
+        in order of citizen_id
+        
+    Raises:       
+        SetNotFoundError:  if set with import_id doesn't exist in db
+    """
+    _check_set_exists(import_id_)
+    batch_size = current_app.config.get('EXPORT_STREAM_BATCH_SIZE', 1000)
+    projection = Projection(fields)
+    return projection, _merge_relatives(import_id_, batch_size, projection)
+
+
+def get_citizens_columns(import_id_, limit=None, after=None, fields=None):
+    """
+    Get set of citizens with certain import_id in columnar form
+    
+    Every field is an array of values of citizens in order of citizen_id. Relatives of all citizens are joined in
+    one array "values", relatives of i-th citizen are values[offsets[i]:offsets[i + 1]].
+    
+    Args:
+        import_id_ (int): import id of set to get
+        limit (int): max number of citizens to get (the whole set if None)
+        after (int): citizen_id after which page starts (from the beginning of set if None)
+        fields (tuple): fields of citizens to get (all of them if None)
+    
+    Returns:
+        dict: arrays of fields of citizens (and "next" as in get_citizens_page if limit is given)
+        
+    Raises:       
+        SetNotFoundError:  if set with import_id doesn't exist in db
+    """
+    if limit is not None:
+        page = get_citizens_page(import_id_, limit, after, fields)
+        projection = Projection(fields)
+        rows = ((tuple(citizen_data.get(key) for key in projection.keys),
+                 citizen_data.get('relatives')) for citizen_data in page["data"])
+        return {"data": _make_columns(projection, rows, formatted=True), "next": page["next"]}
+    projection, rows = iter_citizens_rows(import_id_, fields)
+    return {"data": _make_columns(projection, rows)}
+
+
+def _make_columns(projection, rows, formatted=False):
+    # arrays of fields from pairs (row, relatives)
+    values = [list() for _ in projection.keys]
+    offsets = [0]
+    relatives_values = list()
+    for row, relatives in rows:
+        for column, value in zip(values, row):
+            column.append(value)
+        if relatives is not None:
+            relatives_values.extend(relatives)
+            offsets.append(len(relatives_values))
+    columns = dict(zip(projection.keys, values))
+    if 'birth_date' in columns and not formatted:
+        columns['birth_date'] = dates.format_dates(columns['birth_date'])
+    if projection.relatives:
+        columns['relatives'] = {"offsets": offsets, "values": relatives_values}
+    return projection.project(columns)
+
+
+def _iter_result(result, batch_size):
+    # rows of result fetched in batches
+    rows = result.fetchmany(batch_size)
+    while rows:
+        yield from rows
+        rows = result.fetchmany(batch_size)
+    result.close()
+
+
+def _streamed(query, batch_size):
+    # rows of query read with server-side cursor
+    result = db.session.connection().execution_options(stream_results=True).execute(query)
+    return _iter_result(result, batch_size)
+
+
+def _merge_relatives(import_id_, batch_size, projection):
+    # pairs (row, relatives) of citizens in order of citizen_id
+    citizens = _streamed(select(projection.columns)
+                         .where(Citizens.import_id == import_id_)
+                         .order_by(Citizens.citizen_id), batch_size)
+    if not projection.relatives:
+        for row in citizens:
+            yield row, None
+        return
+    pairs = kinship_pairs(import_id_)
+    kinships = _streamed(select([pairs.c.citizen_id, pairs.c.relative_id])
+                         .order_by(pairs.c.citizen_id, pairs.c.relative_id), batch_size)
+    citizen_id_index = projection.keys.index('citizen_id')
+    pair = next(kinships, None)
+    for row in citizens:
+        citizen_id = row[citizen_id_index]
+        relatives = list()
+        while pair is not None and pair[0] <= citizen_id:
+            if pair[0] == citizen_id:
+                relatives.append(pair[1])
+            pair = next(kinships, None)
+        yield row, relatives
+
+
+def fix_data(import_id_, citizen_id_, request_json, fields=None):
     """
     Updete information about citizen with given import_id and citizen_id
         
@@ -108,6 +736,7 @@ def fix_data(import_id_, citizen_id_, request_json):
         import_id_ (int): import id  of set  where citizen is
         citizen_id_ (int):citizen id whose information to change
         request_json (dict): data to update
+        fields (tuple): fields of citizen to return (all of them if None)
     
     Returns:
         res(dict):    Updated information about citizen
@@ -128,7 +757,9 @@ def fix_data(import_id_, citizen_id_, request_json):
         DBError: if something get wrong during work with db 
     """
     # check if there are set import_id_ in db in there are citizen citizen_id_ in this set
-    citizen = Citizens.query.filter_by(import_id=import_id_, citizen_id=citizen_id_).first()
+    _check_set_exists(import_id_)
+    citizen_filter = and_(Citizens.import_id == import_id_, Citizens.citizen_id == citizen_id_)
+    citizen = db.session.execute(select([Citizens.town, Citizens.birth_date]).where(citizen_filter)).first()
     if not citizen:
         current_app.logger.info(
             "citizen with import_id = {} and citizen_id = {} does not exist".format(import_id_, citizen_id_))
@@ -144,8 +775,8 @@ def fix_data(import_id_, citizen_id_, request_json):
         update_relatives = True
         # Get citizen_id-s of citizens that existent in set with import_id - to test if any relatives in patch data
         # are non-existent
-        citizen_ids = Citizens.query.with_entities(Citizens.citizen_id).filter_by(import_id=import_id_).all()
-        citizen_ids = set(citizen_id for t in citizen_ids for citizen_id in t)
+        citizen_ids = db.session.execute(select([Citizens.citizen_id]).where(Citizens.import_id == import_id_))
+        citizen_ids = set(citizen_id for citizen_id, in citizen_ids)
         # for new relative pairs
         kinship_data = help_data.get_new_relatives(import_id_, citizen_id_, request_json, citizen_ids)
 
@@ -158,26 +789,54 @@ def fix_data(import_id_, citizen_id_, request_json):
 
     # update citizen info
     try:
+        # remember what aggregates depend on before changes
+        old_town = citizen.town
+        old_birth_date = citizen.birth_date
+        # present counts depend on relatives and their birthdays only - relatives are read only if they are needed
+        update_present_counts = update_relatives or "birth_date" in request_json
+        if update_present_counts:
+            pairs = kinship_pairs(import_id_, citizen_id_)
+            old_relatives = [relative_id for relative_id, in db.session.execute(select([pairs.c.relative_id]))]
         # update relatives if necessary  - delete all relative pairs contains citizen_id_ both as Kinships.citizen_id
         # and as Kinships.relative_id and add new pairs of relative connections if there are any
         if update_relatives:
             Kinships.query.filter_by(import_id=import_id_, citizen_id=citizen_id_).delete()
             Kinships.query.filter_by(import_id=import_id_, relative_id=citizen_id_).delete()
             if kinship_data:
-                kinship_dicts = [dict(zip(Kinships.get_keys(), sublist)) for sublist in kinship_data]
-                db.session.execute(Kinships.__table__.insert(), kinship_dicts)
+                insert_rows(Kinships, import_id_, [pair[1:] for pair in kinship_data])
+        # content of the set is changed - it can't be recognized by hash of inserted data anymore, responses made
+        # for previous version are out of date
+        Imports.query.filter_by(import_id=import_id_).update({'content_hash': None, 'version': Imports.version + 1},
+                                                             synchronize_session=False)
         # update other data if it is necessary
         if len(request_json):
-            citizen = Citizens.query.filter_by(import_id=import_id_, citizen_id=citizen_id_).first()
-            citizen.patch(**request_json)
+            db.session.execute(Citizens.__table__.update().where(citizen_filter).values(**request_json))
+        # recompute aggregates of citizens whose relatives or relatives' birthdays are changed and of changed towns
+        if update_present_counts:
+            givers = set(old_relatives)
+            givers.add(citizen_id_)
+            if update_relatives:
+                givers.update(pair[2] for pair in kinship_data)
+                givers.update(pair[1] for pair in kinship_data)
+            refresh_present_counts(import_id_, givers)
+        if "town" in request_json or "birth_date" in request_json:
+            refresh_town_birth_dates(import_id_, {old_town, request_json.get("town", old_town)})
+        # age index follows every version of set (even if ages aren't changed) - row of set is locked by update of
+        # version, so it is exactly the version made by this patch
+        store = age_index.get_store()
+        version = get_import_version(import_id_) if store.has(import_id_) else None
         # get information that we have changed
-        citizen = Citizens.query.filter_by(import_id=import_id_, citizen_id=citizen_id_).first().serialize()
-        kinship_response = Kinships.query.with_entities(Kinships.relative_id).filter_by(import_id=import_id_,
-                                                                                        citizen_id=citizen_id_).all()
-        kinship_ids = [relative_id for t in kinship_response for relative_id in t]
-        for relative_id in kinship_ids:
-            citizen['relatives'].append(relative_id)
+        projection = Projection(fields)
+        row = db.session.execute(select(projection.columns).where(citizen_filter)).first()
+        relatives = None
+        if projection.relatives:
+            pairs = kinship_pairs(import_id_, citizen_id_)
+            relatives = [relative_id for relative_id, in db.session.execute(select([pairs.c.relative_id]))]
+        citizen = projection.project(projection.citizen_data(row, relatives))
         db.session.commit()
+        if version is not None:
+            store.move(import_id_, version, old_town, old_birth_date, request_json.get("town", old_town),
+                       request_json.get("birth_date", old_birth_date))
     except exc.SQLAlchemyError:
         db.session.rollback()
         current_app.logger.info(
@@ -201,30 +860,21 @@ def get_citizens_birthdays_for_import_id(import_id_):
         SetNotFoundError: if set with import_id doesn't exist in db
     """
     # test that citizens' set with id import_id_ exists
-    citizens_response = Citizens.query.filter_by(import_id=import_id_).all()
-    # response shouldn't be empty - raise exception
-    if not citizens_response:
-        current_app.logger.info("import with import_id = {} does not exist".format(import_id_))
-        raise (SetNotFoundError("import with import_id = {} does not exist".format(import_id_)))
+    _check_set_exists(import_id_)
 
-    # get response composed of pairs (citizen, month) and number of presents he have to bay in this month
-    birthdays = (db.session.query(Citizens)
-                 .join(Kinships, (Kinships.relative_id == Citizens.citizen_id))
-                 .filter(Citizens.import_id == import_id_, Kinships.import_id == import_id_)
-                 .with_entities(Kinships.citizen_id.label('giver'),
-                                extract('month', Citizens.birth_date).label('birth_month'),
-                                db.func.count(Citizens.citizen_id).label('presents'))
-                 .group_by('giver', 'birth_month').all())
+    # get pairs (citizen, month) and number of presents he have to bay in this month computed on import
+    birthdays = db.session.execute(select([PresentCounts.month, PresentCounts.citizen_id, PresentCounts.presents])
+                                   .where(PresentCounts.import_id == import_id_)
+                                   .order_by(PresentCounts.month, PresentCounts.citizen_id))
 
     # form a structure to return
     result_dict = {"1": [], "2": [], "3": [], "4": [], "5": [], "6": [], "7": [], "8": [], "9": [], "10": [], "11": [],
                    "12": []}
 
-    for birthday in birthdays:
-        key = str(int(birthday.birth_month))
-        result_dict[key].append({
-            "citizen_id": birthday.giver,
-            "presents": birthday.presents
+    for month, citizen_id, presents in birthdays:
+        result_dict[str(month)].append({
+            "citizen_id": citizen_id,
+            "presents": presents
         })
 
     return {"data": result_dict}
@@ -244,26 +894,126 @@ def get_statistic_for_import_id(import_id_):
     Raises:
         SetNotFoundError:  if set with import_id doesn't exist in db
     """
-    # get town and birth_date about every citizen in set
-    citizens = Citizens.query.with_entities(Citizens.town, Citizens.birth_date).filter_by(import_id=import_id_).all()
-    # shouldn't be empty
-    if not citizens:
-        current_app.logger.info("import with import_id = {} does not exist".format(import_id_))
-        raise (SetNotFoundError("import with import_id = {} does not exist".format(import_id_)))
-
-    # form response
-    age_dict = dict()
-    for citizen in citizens:
-        key = citizen.town
-        if key not in age_dict:
-            age_dict[key] = [help_data.get_age(citizen.birth_date)]
-        else:
-            age_dict[key].append(help_data.get_age(citizen.birth_date))
+    # import_id_ is given as it is in url - check it before any query
+    import_id_ = _check_set_exists(import_id_)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        town_percentiles = percentiles_in_db(import_id_)
+    elif _fits_age_index(import_id_):
+        town_percentiles = percentiles_from_index(import_id_)
+    else:
+        town_percentiles = percentiles_in_python(import_id_)
 
     data = list()
-    for town in age_dict:
-        ages = age_dict[town]
-        percentile_list = percentile(ages, [50, 75, 99], interpolation='linear')
+    for town, percentile_list in town_percentiles:
         data.append({"town": town, "p50": percentile_list[0], "p75": percentile_list[1], "p99": percentile_list[2]})
 
     return {"data": data}
+
+
+def get_next_age_change(import_id_, today=None):
+    """
+    Find the first date after the day when age of somebody of citizens of set changes (statistics of ages of set
+    counted for the day are valid until it)
+
+    Args:
+        import_id_ (int): import_id of set
+        today (datetime.date): day ages are counted for (current one if None)
+
+    Returns:
+        (datetime.date): the first date ages differ from today's ones or None if set is empty
+    """
+    birth_date = TownBirthDates.birth_date
+    birthdays = db.session.execute(select([extract('month', birth_date), extract('day', birth_date)])
+                                   .where(TownBirthDates.import_id == import_id_)
+                                   .distinct())
+    return percentiles.next_age_change(((int(month), int(day)) for month, day in birthdays), today)
+
+
+def percentiles_in_python(import_id_):
+    """
+    Count percentiles of ages of citizens of every town from distribution of birth dates by numpy
+
+    Args:
+        import_id_ (int): import_id of set
+
+    Returns:
+        (list): pairs (town, percentiles 50%, 75% and 99%) in order of towns' names
+    """
+    # get distribution of birth dates in every town computed on import
+    distribution = db.session.execute(select([TownBirthDates.town, TownBirthDates.birth_date, TownBirthDates.citizens])
+                                      .where(TownBirthDates.import_id == import_id_)).fetchall()
+
+    towns, birth_dates, citizens = zip(*distribution) if distribution else ((), (), ())
+    return percentiles.town_percentiles(towns, birth_dates, citizens)
+
+
+def _fits_age_index(import_id_):
+    # set of unknown size is supposed to fit
+    max_bytes = age_index.get_store().max_bytes
+    citizens_count = registry.get_registry().citizens_count(import_id_)
+    return max_bytes > 0 and (citizens_count is None or age_index.estimate_size(citizens_count) <= max_bytes)
+
+
+def percentiles_from_index(import_id_):
+    """
+    Read percentiles of ages of citizens of every town off in-memory index of birth dates building it if there is no
+    index for the current version of set (index is kept only if version hasn't changed while it was built)
+
+    Args:
+        import_id_ (int): import_id of set
+
+    Returns:
+        (list): pairs (town, percentiles 50%, 75% and 99%) in order of towns' names
+    """
+    store = age_index.get_store()
+    version = get_import_version(import_id_)
+    town_percentiles = store.percentiles(import_id_, version)
+    if town_percentiles is None:
+        distribution = db.session.execute(select([TownBirthDates.town, TownBirthDates.birth_date,
+                                                  TownBirthDates.citizens])
+                                          .where(TownBirthDates.import_id == import_id_)
+                                          .order_by(TownBirthDates.town, TownBirthDates.birth_date))
+        index = age_index.TownAgeIndex.from_distribution(version, distribution)
+        town_percentiles = index.percentiles()
+        # set patched by other process between reading of version and distribution - index may be of the next
+        # version, so it isn't kept
+        if get_import_version(import_id_) == version:
+            store.put(import_id_, index)
+    return town_percentiles
+
+
+def percentiles_query(import_id_, today=None):
+    """
+    Make query of percentiles of ages of citizens of every town for postgresql (percentile_cont)
+
+    Args:
+        import_id_ (int): import_id of set
+        today (datetime.date): day to count ages for (current one if None)
+
+    Returns:
+        select of town and array of percentiles 50%, 75% and 99% of its citizens
+    """
+    today = today or datetime.date.today()
+    age = db.func.date_part('year', db.func.age(literal(today, type_=Date), Citizens.birth_date))
+    quantiles = cast(array([percent / 100 for percent in percentiles.PERCENTS]), ARRAY(Float))
+    town_percentiles = db.func.percentile_cont(quantiles, type_=ARRAY(Float)).within_group(age)
+    return (select([Citizens.town, town_percentiles])
+            .where(Citizens.import_id == import_id_)
+            .group_by(Citizens.town))
+
+
+def percentiles_in_db(import_id_):
+    """
+    Count percentiles of ages of citizens of every town by postgresql (percentile_cont) without sending birth dates
+    of citizens from db
+
+    Ages are counted for today's date of the service (not of db). Percentiles aren't rounded (as numpy ones aren't),
+    so they may differ from numpy's ones by float error in the last digits.
+
+    Args:
+        import_id_ (int): import_id of set
+
+    Returns:
+        (list): pairs (town, percentiles 50%, 75% and 99%) in order of towns' names
+    """
+    return sorted((town, values) for town, values in db.session.execute(percentiles_query(import_id_)))
@@ -0,0 +1,147 @@
+"""
+Encoding of responses to json
+
+Encoder is chosen by JSON_ENCODER config parameter: "orjson", "ujson", "json" (standard library) or "auto" (by
+default) - the fastest of installed ones. All of them give compact utf-8 output with sorted keys that is decoded to
+the same values, but it isn't byte to byte the same: floats may be written in different notations (orjson gives 1e22
+and 1e-7 where json gives 1e+22 and 1e-07). Numpy numbers (like percentiles) are encoded as usual ones. Time of
+encoding of every response is logged.
+
+Besides json some responses may be given in other formats negotiated by Accept header: newline delimited json
+(item per line) and columnar json (array per field).
+
+Attributes:
+    MIMETYPE (str): mimetype of json responses
+    NDJSON_MIMETYPE (str): mimetype of newline delimited json responses
+    COLUMNAR_MIMETYPE (str): mimetype of columnar json responses
+"""
+import json
+import time
+
+import numpy
+from flask import current_app, request, has_request_context
+
+MIMETYPE = "application/json"
+NDJSON_MIMETYPE = "application/x-ndjson"
+COLUMNAR_MIMETYPE = "application/vnd.giftr.columnar+json"
+
+
+def _default(obj):
+    # types that encoders don't know
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+    if isinstance(obj, numpy.ndarray):
+        return obj.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def _make_orjson():
+    import orjson
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=option)
+    return dumps
+
+
+def _make_ujson():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False, sort_keys=True, escape_forward_slashes=False,
+                           default=_default).encode("utf-8")
+    return dumps
+
+
+def _make_json():
+    encoder = json.JSONEncoder(ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=_default)
+
+    def dumps(obj):
+        return encoder.encode(obj).encode("utf-8")
+    return dumps
+
+
+# encoders in order of preference
+_ENCODERS = (
+    ("orjson", _make_orjson),
+    ("ujson", _make_ujson),
+    ("json", _make_json),
+)
+
+
+def get_encoder(name="auto"):
+    """
+    Get function encoding objects to json
+
+    Args:
+        name (str): name of encoder or "auto" for the fastest installed one
+
+    Returns:
+        name (str), dumps (function): name of chosen encoder and function turning object to utf-8 encoded json
+
+    Raises:
+        ValueError: if there is no encoder with such name
+        ImportError: if required encoder isn't installed
+    """
+    for encoder_name, make_encoder in _ENCODERS:
+        if name == encoder_name:
+            return encoder_name, make_encoder()
+        if name == "auto":
+            try:
+                return encoder_name, make_encoder()
+            except ImportError:
+                continue
+    raise (ValueError("Unknown json encoder {}".format(name)))
+
+
+def init_app(app):
+    """
+    Choose encoder for application
+    """
+    name, dumps = get_encoder(app.config.get('JSON_ENCODER', 'auto'))
+    app.extensions['json_encoder'] = (name, dumps)
+    app.logger.info("json encoder: {}".format(name))
+
+
+def dumps(obj):
+    """
+    Encode object to json with encoder of current application
+
+    Returns:
+        (bytes): utf-8 encoded json
+    """
+    return current_app.extensions['json_encoder'][1](obj)
+
+
+def negotiate_format(formats=(MIMETYPE, NDJSON_MIMETYPE, COLUMNAR_MIMETYPE)):
+    """
+    Choose format of response for current request by Accept header
+
+    Args:
+        formats (tuple): mimetypes of formats view can give (the first one is default)
+
+    Returns:
+        (str): mimetype of chosen format
+    """
+    return request.accept_mimetypes.best_match(formats, default=formats[0])
+
+
+def json_response(obj, status=200, mimetype=MIMETYPE):
+    """
+    Make json response with encoder of current application logging time of encoding
+
+    Args:
+        obj: object to send
+        status (int): status code of response
+        mimetype (str): mimetype of response
+
+    Returns:
+        response
+    """
+    name, encode = current_app.extensions['json_encoder']
+    start_time = time.perf_counter()
+    body = encode(obj) + b"\n"
+    endpoint = request.endpoint if has_request_context() else None
+    current_app.logger.info("{}: {} bytes encoded by {} in {:.4f}s".format(
+        endpoint, len(body), name, time.perf_counter() - start_time))
+    return current_app.response_class(body, status=status, mimetype=mimetype)
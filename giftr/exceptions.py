@@ -47,6 +47,10 @@ class InvalidJSONError(BadFormatError):
     """
     
 
+class InvalidQueryError(BadFormatError):
+    """Query parameters of request are not valid"""
+
+
 class DBError(Exception):
     """ 
         Exception thrown when something wrong has happened during working with db
@@ -57,3 +61,24 @@ class DBError(Exception):
     def __str__(self): 
         return repr(self.value)
 
+
+class QueueFullError(Exception):
+    """
+        Exception thrown when there are too many background jobs waiting to be performed
+    """
+    def __init__(self, value): 
+        self.value = value 
+  
+    def __str__(self): 
+        return repr(self.value)
+
+
+class IdempotencyKeyConflictError(Exception):
+    """
+        Exception thrown when idempotency key of already performed insert comes with another citizens set
+    """
+    def __init__(self, value): 
+        self.value = value 
+  
+    def __str__(self): 
+        return repr(self.value)
@@ -7,12 +7,13 @@ Help functions that perform data processing such as
 
 """
 from flask import current_app
-import jsonschema
-from dateutil.parser import parse
 import datetime
-from json.decoder import JSONDecodeError
+import hashlib
+import json
+import numpy
+from . import validators, dates, parallel
 from .exceptions import BadDateFormatError, NonUniqueRelativeError, InconsistentRelativesError, \
-    RelativesToNonexistentCitizenError, InvalidJSONError
+    RelativesToNonexistentCitizenError, InvalidJSONError, InvalidQueryError
 
 # Json schemas
 # json-schema to check input data json
@@ -66,8 +67,24 @@ schema_patch = {"type": "object",
                 },
                 "additionalProperties": False}
 
+# check functions compiled from json-schemas by compile_validators()
+insert_validator = None
+patch_validator = None
+# validator for one item of citizens array - to check citizens one by one when they come as a stream
+citizen_validator = None
+
 
 # help functions
+def compile_validators():
+    """
+    Compile json-schemas to check functions - should be done once before the first request
+    """
+    global insert_validator, patch_validator, citizen_validator
+    insert_validator = validators.compile_schema(schema_input)
+    patch_validator = validators.compile_schema(schema_patch)
+    citizen_validator = validators.compile_schema(schema_input["properties"]["citizens"]["items"])
+
+
 def date_to_db_format(date):
     """ 
     Convert date format to suitable for db one
@@ -76,26 +93,36 @@ def date_to_db_format(date):
         date(str): date in original format that sould be "ДД.ММ.ГГГГ"
     
     Returns: 
-        date(str): date suitable for db "YYYY-MM-DD"
+        date(datetime.datetime): date suitable for db
         
     Raises: BadDateFormatError: if date string isn't of "ДД.ММ.ГГГГ" format or have whitespace characters in the
     beginning or the end of the string or if date is not valid
     """
-    # Validate date format
-    if len(date) != 10:
-        current_app.logger.info("String {} is not of ДД.ММ.ГГГГ format".format(date))
-        raise (BadDateFormatError("String {} is not of ДД.ММ.ГГГГ format".format(date)))
-    d, m, y = date.split(".")
-    if len(d) != 2 or len(m) != 2 or len(y) != 4:
-        current_app.logger.info("String {} is not of ДД.ММ.ГГГГ format".format(date))
-        raise (BadDateFormatError("String {} is not of ДД.ММ.ГГГГ format".format(date)))
-    db_date = "-".join((y, m, d))
     try:
-        parse(db_date)
-    except ValueError:
-        current_app.logger.info("String {} is not valid date".format(date))
-        raise (BadDateFormatError("String {} is not valid date".format(date)))
-    return datetime.datetime(int(y), int(m), int(d))
+        return dates.parse_date(date)
+    except BadDateFormatError as e:
+        current_app.logger.info(e.value)
+        raise
+
+
+def dates_to_db_format(date_list):
+    """
+    Convert the whole column of dates to format suitable for db
+    
+    Args:
+        date_list(list): dates in original format that sould be "ДД.ММ.ГГГГ"
+    
+    Returns:
+        (list): dates suitable for db in the same order
+        
+    Raises: BadDateFormatError: if some date string isn't of "ДД.ММ.ГГГГ" format or have whitespace characters in the
+    beginning or the end of the string or if date is not valid
+    """
+    try:
+        return dates.parse_dates(date_list)
+    except BadDateFormatError as e:
+        current_app.logger.info(e.value)
+        raise
 
 
 def date_to_output_format(date):
@@ -137,9 +164,30 @@ def validate_insert_json(request_json):
     Raises:
         InvalidJSONError: if request_json is not valid json    
     """
+    if insert_validator is None:
+        compile_validators()
+    try:
+        insert_validator(request_json)
+    except validators.ValidationError as e:
+        current_app.logger.info("Invalid json:{}".format(str(e)))
+        raise (InvalidJSONError("Invalid json:{}".format(str(e))))
+
+
+def validate_citizen_json(citizen):
+    """
+    Validate format of one citizen from citizens set
+    
+    Args:
+        citizen (dict): citizen structure
+    
+    Raises:
+        InvalidJSONError: if citizen is of not required structure or values of citizen are of not valid types
+    """
+    if citizen_validator is None:
+        compile_validators()
     try:
-        jsonschema.validate(request_json, schema_input)
-    except (jsonschema.exceptions.ValidationError, jsonschema.exceptions.SchemaError, JSONDecodeError) as e:
+        citizen_validator(citizen)
+    except validators.ValidationError as e:
         current_app.logger.info("Invalid json:{}".format(str(e)))
         raise (InvalidJSONError("Invalid json:{}".format(str(e))))
 
@@ -154,9 +202,11 @@ def validate_patch_json(request_json):
     Raises:
         InvalidJSONError: if request_json is not valid json
     """
+    if patch_validator is None:
+        compile_validators()
     try:
-        jsonschema.validate(request_json, schema_patch)
-    except (jsonschema.exceptions.ValidationError, jsonschema.exceptions.SchemaError, JSONDecodeError) as e:
+        patch_validator(request_json)
+    except validators.ValidationError as e:
         current_app.logger.info("Invalid json:{}".format(str(e)))
         raise (InvalidJSONError("Invalid json:{}".format(str(e))))
 
@@ -165,6 +215,9 @@ def get_insert_data(request_json):
     """
     Unpack data from request_json structure
     
+    Sets of PARALLEL_VALIDATION_THRESHOLD citizens and more are processed by pool of VALIDATION_PROCESSES processes
+    (errors are the same as if the set was processed in one process)
+    
     Args:
         request_json (dict): citizens set in dict format
     
@@ -182,38 +235,259 @@ def get_insert_data(request_json):
     """
 
     citizens = request_json["citizens"]
+    threshold = current_app.config.get('PARALLEL_VALIDATION_THRESHOLD')
+    if threshold and len(citizens) >= threshold:
+        return get_insert_data_parallel(citizens, current_app.config.get('VALIDATION_PROCESSES'))
+    try:
+        citizens_data, kinships_data, kinship_set = unpack_citizens(citizens)
+    except NonUniqueRelativeError as e:
+        current_app.logger.info(e.value)
+        raise
+    check_kinships_consistency(kinship_set)
+    return citizens_data, kinships_data
+
+
+def get_insert_data_parallel(citizens, processes=None):
+    """
+    Unpack data about citizens in pool of processes
+    
+    Citizens are split to contiguous shards, every shard is unpacked by unpack_citizens_shard, then pairs of
+    relatives that don't have mutual pair in their shards are matched with each other.
+    
+    Args:
+        citizens (list): validated citizens structures
+        processes (int): number of processes (number of cpus if None)
+    
+    Returns:
+        citizens_data (list) : data about citizens formed for inserting in db (without information about kinship)
+        
+        kinships_data (list) : data about kinshps formed for inserting in db
+    
+    Raises: the same errors as get_insert_data
+    """
+    results = parallel.map_shards(unpack_citizens_shard, citizens, processes,
+                                  current_app.config.get('VALIDATION_PYTHON'))
+    # errors are looked for in the same order as unpack_citizens does: dates of all citizens first, then relatives
+    for stage in ('dates', 'relatives'):
+        for result in results:
+            error = result['error']
+            if error is not None and error[0] == stage:
+                current_app.logger.info(error[1].value)
+                raise error[1]
     citizens_data = list()
     kinships_data = list()
     kinship_set = set()
+    for result in results:
+        citizens_data.extend(result['citizens_data'])
+        kinships_data.extend(result['kinships_data'])
+        # pair that is waited for in both shards is matched
+        kinship_set ^= result['kinship_set']
+    check_kinships_consistency(kinship_set)
+    return citizens_data, kinships_data
+
+
+def unpack_citizens_shard(citizens):
+    """
+    Unpack part of citizens set in separate process (there is no application context to log errors, so they are
+    returned)
+    
+    Args:
+        citizens (list): validated citizens structures
+    
+    Returns:
+        (dict): citizens_data, kinships_data and kinship_set as they are returned by unpack_citizens and error -
+        None or pair ('dates' or 'relatives', exception)
+    """
+    result = {'citizens_data': None, 'kinships_data': None, 'kinship_set': None, 'error': None}
+    try:
+        birth_dates = dates.parse_dates([citizen['birth_date'] for citizen in citizens])
+    except BadDateFormatError as e:
+        result['error'] = ('dates', e)
+        return result
+    try:
+        result['citizens_data'], result['kinships_data'], result['kinship_set'] = \
+            unpack_citizens(citizens, birth_dates)
+    except NonUniqueRelativeError as e:
+        result['error'] = ('relatives', e)
+    return result
+
+
+def unpack_citizens(citizens, birth_dates=None):
+    """
+    Unpack data about citizens without check of consistency of relatives
+    
+    Args:
+        citizens (list): validated citizens structures
+        birth_dates (list): converted birth dates of citizens if they have been already converted
+    
+    Returns:
+        citizens_data (list) : data about citizens formed for inserting in db (without information about kinship)
+        
+        kinships_data (list) : data about kinshps formed for inserting in db
+        
+        kinship_set (set) : pairs of relatives that don't have a mutual pair
+        
+    Raises: BadDateFormatError: if date string isn't of "ДД.ММ.ГГГГ" format or have whitespace characters in the
+    beginning or the end of the string or if date is not valid
+        
+        NonUniqueRelativeError: if relatives ids not unique for one citizen
+    """
+    citizens_data = list()
+    kinships_data = list()
+    kinship_set = set()
+    if birth_dates is None:
+        birth_dates = dates_to_db_format([citizen['birth_date'] for citizen in citizens])
+    for citizen, birth_date in zip(citizens, birth_dates):
+        citizen_data, citizen_kinships = unpack_citizen(citizen, kinship_set, birth_date)
+        citizens_data.append(citizen_data)
+        kinships_data.extend(citizen_kinships)
+    return citizens_data, kinships_data, kinship_set
+
+
+def iter_insert_data(citizens, content_hash=None):
+    """
+    Validate and unpack citizens one by one - for citizens that come as a stream
+    
+    Args:
+        citizens (iterable): citizens structures as they appear in citizens set
+        content_hash (ContentHash): if given every valid citizen is added to it
+    
+    Returns:
+        (generator): pairs (citizen_data, kinships_data) for every citizen formed for inserting in db
+        
+    Raises: InvalidJSONError: if some citizen structure is of not required structure or values are of not valid types
+    
+        BadDateFormatError: if date string isn't of "ДД.ММ.ГГГГ" format or have whitespace characters in the
+    beginning or the end of the string or if date is not valid
+        
+        NonUniqueRelativeError: if relatives ids not unique for one citizen
+        
+        InconsistentRelativesError: if relatives links are inconsistant (raised after the last citizen)
+    """
+    kinship_set = set()
     for citizen in citizens:
-        citizen_id = citizen['citizen_id']
-        town = citizen['town']
-        street = citizen['street']
-        building = citizen['building']
-        apartment = citizen['apartment']
-        name = citizen['name']
+        validate_citizen_json(citizen)
+        try:
+            unpacked = unpack_citizen(citizen, kinship_set)
+        except NonUniqueRelativeError as e:
+            current_app.logger.info(e.value)
+            raise
+        if content_hash is not None:
+            content_hash.add(citizen)
+        yield unpacked
+    check_kinships_consistency(kinship_set)
+
+
+def unpack_citizen(citizen, kinship_set, birth_date=None):
+    """
+    Unpack data about one citizen and keep track of his relative connections
+    
+    Args:
+        citizen (dict): citizen structure from citizens set
+        kinship_set (set): pairs of relatives that still don't have a mutual pair, is updated in place
+        birth_date (datetime.datetime): citizen's birth date if it has been already converted
+    
+    Returns:
+        citizen_data (list) : data about citizen formed for inserting in db (without information about kinship)
+        
+        kinships_data (list) : data about citizen's kinships formed for inserting in db
+        
+    Raises: BadDateFormatError: if date string isn't of "ДД.ММ.ГГГГ" format or have whitespace characters in the
+    beginning or the end of the string or if date is not valid
+        
+        NonUniqueRelativeError: if relatives ids not unique for one citizen
+    """
+    citizen_id = citizen['citizen_id']
+    town = citizen['town']
+    street = citizen['street']
+    building = citizen['building']
+    apartment = citizen['apartment']
+    name = citizen['name']
+    if birth_date is None:
         birth_date = date_to_db_format(citizen['birth_date'])
-        gender = citizen['gender']
-        citizens_data.append([citizen_id, town, street, building, apartment, name, birth_date, gender])
-        relatives = citizen['relatives']
-        if len(relatives) != len(set(relatives)):
-            current_app.logger.info("More then one relative with the same id for one citizen")
-            raise (NonUniqueRelativeError("More then one relative with the same id for one citizen"))
-
-        # Generate pairs of relatives for this citizen
-        for relative in relatives:
+    gender = citizen['gender']
+    citizen_data = [citizen_id, town, street, building, apartment, name, birth_date, gender]
+    relatives = citizen['relatives']
+    if len(relatives) != len(set(relatives)):
+        raise (NonUniqueRelativeError("More then one relative with the same id for one citizen"))
+
+    # Generate pairs of relatives for this citizen - every pair is stored once as (smaller id, bigger id), it is
+    # emitted by citizen with smaller id (mutual pair has to be emitted by relative or set is inconsistent)
+    kinships_data = list()
+    for relative in relatives:
+        if citizen_id <= relative:
             kinships_data.append([citizen_id, relative])
-            # keep track of pairs of relatives - every one should has pair
-            pair_in_order = (citizen_id, relative) if citizen_id < relative else (relative, citizen_id)
-            if citizen_id != relative:
-                if pair_in_order not in kinship_set:
-                    kinship_set.add(pair_in_order)
-                else:
-                    kinship_set.remove(pair_in_order)
+        # keep track of pairs of relatives - every one should has pair
+        pair_in_order = (citizen_id, relative) if citizen_id < relative else (relative, citizen_id)
+        if citizen_id != relative:
+            if pair_in_order not in kinship_set:
+                kinship_set.add(pair_in_order)
+            else:
+                kinship_set.remove(pair_in_order)
+    return citizen_data, kinships_data
+
+
+def check_kinships_consistency(kinship_set):
+    """
+    Check that every relative connection has got its mutual pair
+    
+    Args:
+        kinship_set (set): pairs of relatives that don't have a mutual pair
+    
+    Raises:
+        InconsistentRelativesError: if relatives links are inconsistant
+    """
     if len(kinship_set) != 0:
         current_app.logger.info("Information about relatives inconsistent")
         raise (InconsistentRelativesError("Information about relatives inconsistent"))
-    return citizens_data, kinships_data
+
+
+class ContentHash:
+    """
+    Hash of content of citizens set that doesn't depend on order of citizens and order of relatives
+    
+    Every citizen is hashed separately (sha256 of canonical json) as they come, the hash of the set is sha256 of
+    these digests sorted - so the same set gives the same sequence of digests whatever order it has and two sets
+    have the same hash only if sha256 collides. Hashes of parts of the set may be combined.
+    """
+    DIGEST_SIZE = 32
+
+    def __init__(self):
+        self._digests = bytearray()
+
+    def add(self, citizen):
+        """
+        Add citizen (validated structure from citizens set) to hash
+        """
+        canonical = dict(citizen, relatives=sorted(citizen['relatives']))
+        dump = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        self._digests += hashlib.sha256(dump.encode('utf-8')).digest()
+
+    def combine(self, other):
+        """
+        Add hash of another part of the set
+        """
+        self._digests += other._digests
+
+    def hexdigest(self):
+        digests = numpy.frombuffer(bytes(self._digests), dtype='S{}'.format(self.DIGEST_SIZE))
+        return hashlib.sha256(numpy.sort(digests).tobytes()).hexdigest()
+
+
+def get_content_hash(citizens):
+    """
+    Get hash of content of citizens set to recognize repeated imports
+    
+    Args:
+        citizens (list): validated citizens structures
+    
+    Returns:
+        (str): hex digest of hash that doesn't depend on order of citizens and order of relatives
+    """
+    content_hash = ContentHash()
+    for citizen in citizens:
+        content_hash.add(citizen)
+    return content_hash.hexdigest()
 
 
 def get_new_relatives(import_id, citizen_id, request_json, citizen_ids):
@@ -227,7 +501,7 @@ def get_new_relatives(import_id, citizen_id, request_json, citizen_ids):
         citizen_ids (set): set ov valid citizen_ids
     
     Returns: 
-        kinships_data (list): pairs of citizens' kinships to insert into table
+        kinships_data (list): pairs of citizens' kinships to insert into table (every pair once with smaller id first)
         
     Raises:
         NonUniqueRelativeError: if relatives ids not unique for one citizen
@@ -244,8 +518,78 @@ def get_new_relatives(import_id, citizen_id, request_json, citizen_ids):
         if relative not in citizen_ids:
             current_app.logger.info("Can't be relative to non-existent citizen")
             raise (RelativesToNonexistentCitizenError("Can't be relative to non-existent citizen"))
-        kinships_data.append((import_id, citizen_id, relative))
-        if citizen_id != relative:
-            kinships_data.append((import_id, relative, citizen_id))
+        kinships_data.append((import_id, min(citizen_id, relative), max(citizen_id, relative)))
 
     return kinships_data
+
+
+def get_positive_int_arg(args, name):
+    """
+    Get optional positive integer query parameter
+    
+    Args:
+        args (dict): query parameters of request
+        name (str): name of parameter
+    
+    Returns:
+        (int): value of parameter or None if it isn't given
+    
+    Raises:
+        InvalidQueryError: if value of parameter isn't positive integer
+    """
+    value = args.get(name)
+    if value is None:
+        return None
+    if not (value.isascii() and value.isdigit()) or int(value) <= 0:
+        current_app.logger.info("Parameter {} has to be positive integer".format(name))
+        raise (InvalidQueryError("Parameter {} has to be positive integer".format(name)))
+    return int(value)
+
+
+def get_int_arg(args, name):
+    """
+    Get optional integer query parameter (citizen_id may be zero or negative)
+    
+    Args:
+        args (dict): query parameters of request
+        name (str): name of parameter
+    
+    Returns:
+        (int): value of parameter or None if it isn't given
+    
+    Raises:
+        InvalidQueryError: if value of parameter isn't integer
+    """
+    value = args.get(name)
+    if value is None:
+        return None
+    digits = value[1:] if value.startswith("-") else value
+    if not (digits.isascii() and digits.isdigit()):
+        current_app.logger.info("Parameter {} has to be integer".format(name))
+        raise (InvalidQueryError("Parameter {} has to be integer".format(name)))
+    return int(value)
+
+
+def get_fields_arg(args):
+    """
+    Get optional list of citizen's fields to return from query parameter fields (comma separated names)
+    
+    Args:
+        args (dict): query parameters of request
+    
+    Returns:
+        (tuple): names of fields or None if parameter isn't given
+    
+    Raises:
+        InvalidQueryError: if there is unknown field name
+    """
+    value = args.get('fields')
+    if value is None:
+        return None
+    fields = tuple(field.strip() for field in value.split(','))
+    known_fields = schema_input["properties"]["citizens"]["items"]["properties"]
+    for field in fields:
+        if field not in known_fields:
+            current_app.logger.info("Unknown field {}".format(field))
+            raise (InvalidQueryError("Unknown field {}".format(field)))
+    return fields
@@ -0,0 +1,82 @@
+"""
+Imports performed in background by bounded pool of threads
+
+State of every job is kept in import_jobs table, so any worker of the service can answer about it. Number of jobs
+that are queued or running in one process is limited by IMPORT_JOB_QUEUE_SIZE, number of threads performing them -
+by IMPORT_JOB_WORKERS.
+"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from .exceptions import BadFormatError, DBError, QueueFullError, IdempotencyKeyConflictError
+from . import db_helper
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+def _get_executor(app):
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _slots = threading.BoundedSemaphore(app.config.get('IMPORT_JOB_QUEUE_SIZE', 8))
+            _executor = ThreadPoolExecutor(max_workers=app.config.get('IMPORT_JOB_WORKERS', 2),
+                                           thread_name_prefix='import-job')
+    return _executor
+
+
+def submit_import(request_json, idempotency_key=None):
+    """
+    Register import job and put it to the queue
+
+    Args:
+        request_json (dict): data about citizens to insert
+        idempotency_key (str): key given by client to recognize retries of the same request
+
+    Returns:
+        job_id (int): id of job to ask about its state
+
+    Raises:
+        QueueFullError: if there are too many jobs waiting in this process
+        DBError: if job can't be registered
+    """
+    app = current_app._get_current_object()
+    executor = _get_executor(app)
+    if not _slots.acquire(blocking=False):
+        current_app.logger.info("Import queue is full")
+        raise (QueueFullError("Import queue is full"))
+    try:
+        job_id = db_helper.create_import_job()
+        executor.submit(_run_import, app, job_id, request_json, idempotency_key)
+    except Exception:
+        _slots.release()
+        raise
+    return job_id
+
+
+def _run_import(app, job_id, request_json, idempotency_key):
+    """
+    Perform import job and save its result
+    """
+    try:
+        with app.app_context():
+            db_helper.update_import_job(job_id, 'running')
+            try:
+                import_id = db_helper.insert_citizens_set(request_json, idempotency_key)
+            except (BadFormatError, DBError, IdempotencyKeyConflictError) as e:
+                db_helper.update_import_job(job_id, 'failed', error=str(e))
+                return
+            except Exception as e:
+                traceback.print_exc()
+                db_helper.update_import_job(job_id, 'failed', error=str(e))
+                return
+            db_helper.update_import_job(job_id, 'done', import_id=import_id)
+    except Exception:
+        # job state can't be saved - nothing else to do
+        traceback.print_exc()
+    finally:
+        _slots.release()
@@ -0,0 +1,205 @@
+"""
+Incremental parsing of citizens set json that comes as a stream of bytes and incremental output of big responses
+
+Input json has to be of form {"citizens": [{...}, {...}, ...]} - so instead of parsing the whole document at once
+citizens are taken from the array one by one and only one chunk of the stream is kept in memory at any moment.
+Output json of form {"data": [{...}, {...}, ...]} (or newline delimited json) is made the same way - item by item.
+
+Attributes:
+    CHUNK_SIZE (int): Number of bytes read from the stream at once
+"""
+import codecs
+import json
+
+from .exceptions import InvalidJSONError
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+
+# json error this close to the end of the buffer may be caused by token cut by the end of the chunk (\uXXXX is the
+# longest one)
+_MAX_CUT_TOKEN = 6
+
+
+class _StreamReader:
+    """
+    Keeps the unparsed tail of decoded text and reads more from the stream when it is needed
+    """
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        """
+        Append next chunk of the stream to the buffer, dropping the part that has been already parsed
+
+        Returns:
+            (bool): False if the stream is exhausted
+        """
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        try:
+            text = self.decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError as e:
+            raise (InvalidJSONError("Invalid json:{}".format(str(e))))
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return bool(chunk) or bool(text)
+
+    def next_char(self):
+        """
+        Skip whitespaces and return next significant character without consuming it ("" at the end of the stream)
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, chars):
+        """
+        Consume next significant character if it is one of chars
+
+        Returns:
+            (str): consumed character
+
+        Raises:
+            InvalidJSONError: if next significant character is not one of chars
+        """
+        char = self.next_char()
+        if not char or char not in chars:
+            found = repr(char) if char else "end of data"
+            raise (InvalidJSONError("Invalid json:expected one of {} but found {}"
+                                    .format(", ".join(repr(c) for c in chars), found)))
+        self.pos += 1
+        return char
+
+    def _is_truncated(self, error):
+        # error may be caused by the end of the buffer: unclosed string or cut token (literal, number or escape
+        # sequence) in the last characters
+        return (error.msg.startswith("Unterminated string")
+                or len(self.buffer) - error.pos < _MAX_CUT_TOKEN)
+
+    def decode_value(self):
+        """
+        Decode next json value of the stream
+
+        Raises:
+            InvalidJSONError: if there is no valid json value in the stream
+        """
+        self.next_char()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # value could be cut by the end of the chunk - try to read more, other errors are reported at once
+                # without reading the rest of the stream
+                if self._is_truncated(e) and self.read_more():
+                    continue
+                raise (InvalidJSONError("Invalid json:{}".format(str(e))))
+            # numbers and literals may be cut by the end of the chunk too even if they were decoded
+            if end == len(self.buffer) and not self.eof and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_citizens(stream, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over citizens of citizens set json without reading the whole stream in memory
+
+    Args:
+        stream: file-like object containing citizens set json as utf-8 encoded bytes
+        chunk_size (int): number of bytes to read from the stream at once
+
+    Returns:
+        (generator): citizens as they appear in "citizens" array (citizens structures themselves aren't validated)
+
+    Raises:
+        InvalidJSONError: if stream doesn't contain valid json or json isn't of {"citizens": [...]} structure
+    """
+    reader = _StreamReader(stream, chunk_size)
+    reader.expect("{")
+    if reader.next_char() == "}":
+        raise (InvalidJSONError("Invalid json:'citizens' is a required property"))
+    key = reader.decode_value()
+    if key != "citizens":
+        raise (InvalidJSONError("Invalid json:Additional properties are not allowed ({!r} was unexpected)"
+                                .format(key)))
+    reader.expect(":")
+    if reader.next_char() != "[":
+        value = reader.decode_value()
+        raise (InvalidJSONError("Invalid json:{!r} is not of type 'array'".format(value)))
+    reader.expect("[")
+    if reader.next_char() == "]":
+        reader.expect("]")
+    else:
+        while True:
+            yield reader.decode_value()
+            if reader.expect(",]") == "]":
+                break
+    if reader.expect(",}") == ",":
+        raise (InvalidJSONError("Invalid json:Additional properties are not allowed"))
+    if reader.next_char():
+        raise (InvalidJSONError("Invalid json:extra data after citizens set"))
+
+
+def iter_data_json(items, dumps, items_per_chunk=100):
+    """
+    Make json {"data": [...]} of items piece by piece
+
+    Args:
+        items (iterable): items of "data" array
+        dumps (function): function that turns one item to utf-8 encoded json
+        items_per_chunk (int): number of items joined into one piece
+
+    Yields:
+        (bytes): pieces of json in order
+    """
+    yield b'{"data":['
+    chunk = list()
+    first = True
+    for item in items:
+        chunk.append(dumps(item))
+        if len(chunk) >= items_per_chunk:
+            yield (b"" if first else b",") + b",".join(chunk)
+            first = False
+            chunk.clear()
+    if chunk:
+        yield (b"" if first else b",") + b",".join(chunk)
+    yield b']}\n'
+
+
+def iter_ndjson(items, dumps, items_per_chunk=100):
+    """
+    Make newline delimited json of items (json of item per line) piece by piece
+
+    Args:
+        items (iterable): items to put to lines
+        dumps (function): function that turns one item to utf-8 encoded json
+        items_per_chunk (int): number of lines joined into one piece
+
+    Yields:
+        (bytes): pieces of json in order
+    """
+    chunk = list()
+    for item in items:
+        chunk.append(dumps(item))
+        if len(chunk) >= items_per_chunk:
+            chunk.append(b"")
+            yield b"\n".join(chunk)
+            chunk.clear()
+    if chunk:
+        chunk.append(b"")
+        yield b"\n".join(chunk)
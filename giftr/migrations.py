@@ -0,0 +1,94 @@
+"""
+Upgrade of existing database to the current schema and storage format
+
+Is performed by command:
+    flask upgrade-db
+Every step may be performed on already upgraded database without harm.
+"""
+from sqlalchemy import inspect, select, func
+
+from .models import db, Citizens, Imports, Kinships, TownBirthDates
+from . import db_helper
+
+
+def add_missing_columns():
+    """
+    Add columns of models that are absent in tables created by previous versions (new columns have to be nullable
+    or have server default)
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing:
+                definition = '{} {}'.format(column.name, column.type.compile(dialect=db.engine.dialect))
+                if column.server_default is not None:
+                    definition += ' NOT NULL DEFAULT {}'.format(column.server_default.arg)
+                db.session.execute('ALTER TABLE {} ADD COLUMN {}'.format(table.name, definition))
+    db.session.commit()
+
+
+def create_missing_indexes():
+    """
+    Create indexes of models that are absent in tables created by previous versions
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+
+
+def compact_kinships():
+    """
+    Keep every pair of relatives once - previous versions had kept pair (a, b) as two rows (a, b) and (b, a)
+
+    Returns:
+        (int): number of deleted rows
+    """
+    return Kinships.query.filter(Kinships.citizen_id > Kinships.relative_id).delete(synchronize_session=False)
+
+
+def fill_aggregates():
+    """
+    Compute aggregates for sets that have been inserted by previous versions (they were computed on every request)
+
+    Returns:
+        (int): number of sets aggregates are computed for
+    """
+    computed = db.session.query(TownBirthDates.import_id).distinct()
+    import_ids = [import_id for import_id, in db.session.query(Citizens.import_id).distinct()
+                  .filter(Citizens.import_id.notin_(computed))]
+    for import_id in import_ids:
+        db_helper.refresh_aggregates(import_id)
+    return len(import_ids)
+
+
+def fill_citizens_counts():
+    """
+    Count citizens of sets that have been inserted by previous versions (they didn't keep number of citizens)
+
+    Returns:
+        (int): number of sets citizens are counted for
+    """
+    count = (select([func.count(Citizens.citizen_id)])
+             .where(Citizens.import_id == Imports.import_id)
+             .as_scalar())
+    return Imports.query.filter(Imports.citizens_count.is_(None)) \
+        .update({'citizens_count': count}, synchronize_session=False)
+
+
+def upgrade_db():
+    """
+    Create tables that don't exist and bring data of existing ones to the current format
+    """
+    db.create_all()
+    add_missing_columns()
+    create_missing_indexes()
+    deleted = compact_kinships()
+    db.session.commit()
+    fill_aggregates()
+    fill_citizens_counts()
+    db.session.commit()
+    return deleted
@@ -3,6 +3,8 @@
 """
 from flask_sqlalchemy import SQLAlchemy
 
+from . import dates
+
 db = SQLAlchemy()
 
 
@@ -86,9 +88,7 @@ class Citizens(db.Model):
         """
         Change date format to  "ДД.ММ.ГГГГ"
         """
-        month = date.month if date.month >= 10 else "0" + str(date.month)
-        day = date.day if date.day >= 10 else "0" + str(date.day)
-        return "{}.{}.{}".format(day, month, date.year)
+        return dates.format_date(date)
 
     @staticmethod
     def get_keys():
@@ -101,7 +101,11 @@ class Citizens(db.Model):
 class Kinships(db.Model):
     """
     class-model for kinships table - table contains information about relative relations
+    
+    Relation is mutual so every pair of relatives is kept once with citizen_id <= relative_id
     """
+    __table_args__ = (db.Index('ix_kinships_relative', 'import_id', 'relative_id'),)
+
     import_id = db.Column(db.Integer, primary_key=True, nullable=False)
     citizen_id = db.Column(db.Integer, primary_key=True, nullable=False)
     relative_id = db.Column(db.Integer, primary_key=True, nullable=False)
@@ -125,6 +129,56 @@ class Kinships(db.Model):
 
 class Imports(db.Model):
     """
-        class-model for imports table - table contains import id-s 
+        class-model for imports table - table contains import id-s, number of citizens in set, information to
+        recognize repeated imports and version of set that is increased on every change of it
     """
     import_id = db.Column(db.Integer, primary_key=True)
+    citizens_count = db.Column(db.Integer, nullable=True)
+    content_hash = db.Column(db.String(64), index=True, nullable=True)
+    idempotency_key = db.Column(db.String, index=True, unique=True, nullable=True)
+    # content hash of the request that has inserted set (it isn't reset by changes of set as content_hash is)
+    request_hash = db.Column(db.String(64), nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+class ImportJobs(db.Model):
+    """
+        class-model for import_jobs table - table contains state of imports performed in background
+    """
+    job_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String, db.Enum('queued', 'running', 'done', 'failed', name='job_statuses'), nullable=False)
+    import_id = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.String, nullable=True)
+
+    def serialize(self):
+        """
+        Return object content as dict (import_id only for done job and error only for failed one)
+        """
+        job = {'job_id': self.job_id, 'status': self.status}
+        if self.status == 'done':
+            job['import_id'] = self.import_id
+        if self.status == 'failed':
+            job['error'] = self.error
+        return job
+
+
+class PresentCounts(db.Model):
+    """
+        class-model for present_counts table - table contains number of presents every citizen buys in every month
+        (is computed on import and kept up to date on patch)
+    """
+    import_id = db.Column(db.Integer, primary_key=True, nullable=False)
+    citizen_id = db.Column(db.Integer, primary_key=True, nullable=False)
+    month = db.Column(db.Integer, primary_key=True, nullable=False)
+    presents = db.Column(db.Integer, nullable=False)
+
+
+class TownBirthDates(db.Model):
+    """
+        class-model for town_birth_dates table - table contains number of citizens of every town born in every date
+        (is computed on import and kept up to date on patch)
+    """
+    import_id = db.Column(db.Integer, primary_key=True, nullable=False)
+    town = db.Column(db.String, primary_key=True, nullable=False)
+    birth_date = db.Column(db.DateTime, primary_key=True, nullable=False)
+    citizens = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,110 @@
+"""
+Pool of processes for CPU-bound processing of big citizens sets
+
+Pool is created on first use and kept for the life of the process, it is shut down at exit of the process, so its
+workers aren't left behind. Processes are started with "spawn" method - forking of multithreaded server process isn't
+safe. Spawned processes run python interpreter of the environment the service runs in: under uWSGI sys.executable is
+uwsgi binary, so interpreter is looked for in sys.prefix (it may be set explicitly by VALIDATION_PYTHON config
+parameter).
+"""
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pool = None
+_pool_size = None
+_lock = threading.Lock()
+
+
+def python_executable(executable=None):
+    """
+    Find python interpreter to spawn processes with
+
+    Args:
+        executable (str): path to interpreter given explicitly
+
+    Returns:
+        (str): executable itself if it is given, sys.executable if it is python or python of sys.prefix otherwise
+    """
+    if executable:
+        return executable
+    if os.path.basename(sys.executable).startswith("python"):
+        return sys.executable
+    for name in ("python3", "python"):
+        path = os.path.join(sys.prefix, "bin", name)
+        if os.path.exists(path):
+            return path
+    return sys.executable
+
+
+def get_pool(processes=None, executable=None):
+    """
+    Get pool of processes creating it if it is necessary
+
+    Args:
+        processes (int): number of processes in pool (number of cpus if None)
+        executable (str): python interpreter for processes (see python_executable)
+
+    Returns:
+        (ProcessPoolExecutor): pool
+    """
+    global _pool, _pool_size
+    processes = processes or os.cpu_count() or 1
+    with _lock:
+        if _pool is None or _pool_size != processes:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(python_executable(executable))
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+            _pool_size = processes
+    return _pool
+
+
+def shutdown():
+    """
+    Shut down pool of processes waiting for its workers to exit (the next get_pool creates a new one)
+    """
+    global _pool, _pool_size
+    with _lock:
+        pool, _pool, _pool_size = _pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+atexit.register(shutdown)
+
+
+def split(items, shards_number):
+    """
+    Split list to contiguous shards of almost equal size
+
+    Args:
+        items (list): list to split
+        shards_number (int): number of shards
+
+    Returns:
+        (list): shards in order of items (empty shards are omitted)
+    """
+    shard_size = -(-len(items) // max(shards_number, 1))
+    return [items[start:start + shard_size] for start in range(0, len(items), max(shard_size, 1))]
+
+
+def map_shards(func, items, processes=None, executable=None):
+    """
+    Apply func to contiguous shards of items in pool of processes
+
+    Args:
+        func (function): module-level function taking list of items (it and its results have to be picklable)
+        items (list): items to process
+        processes (int): number of processes (and shards)
+        executable (str): python interpreter for processes (see python_executable)
+
+    Returns:
+        (list): results of func for every shard in order of shards
+    """
+    processes = processes or os.cpu_count() or 1
+    return list(get_pool(processes, executable).map(func, split(items, processes)))
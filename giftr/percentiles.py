@@ -0,0 +1,167 @@
+"""
+Vectorized computation of percentiles of ages of citizens grouped by towns
+
+The whole import is processed by a few numpy operations: ages are computed from datetime64 birth dates at once,
+towns are grouped by one sort and percentiles of all towns are taken from sorted segments of ages together. Results
+are the same as numpy.percentile(ages, percents, interpolation='linear') of numpy 1.22 and newer gives for every town
+separately.
+
+Rows come from db as python objects, so they are converted to arrays by the cheapest ways (dates by ordinals, towns
+by dict of codes) - generic numpy conversions of them cost more than the computation itself.
+
+Statistics of sets are read off in-memory age index (age_index) if it fits its budget and are counted by postgresql
+itself, so the engine counts them only for sets that don't fit the index in other dbs.
+
+Attributes:
+    PERCENTS (tuple): percentiles of ages the api gives
+"""
+import calendar
+import datetime
+
+import numpy
+
+PERCENTS = (50, 75, 99)
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def get_ages(birth_dates, today=None):
+    """
+    Convert birth dates to ages regarding the day (the same way as help_data.get_age does)
+
+    Args:
+        birth_dates (numpy.ndarray): birth dates as datetime64[D]
+        today (datetime.date): day to count ages for (current one if None)
+
+    Returns:
+        (numpy.ndarray): ages (int64)
+    """
+    today = today or datetime.date.today()
+    months = birth_dates.astype('datetime64[M]')
+    years = months.astype('datetime64[Y]').astype(numpy.int64) + 1970
+    # month and day as one number to compare with today's ones
+    month_days = ((months.astype(numpy.int64) % 12 + 1) * 100
+                  + (birth_dates - months).astype(numpy.int64) + 1)
+    return today.year - years - (month_days > today.month * 100 + today.day)
+
+
+def next_age_change(birthdays, today=None):
+    """
+    Find the first date after the day when age of somebody of citizens changes (citizens born on 29 February get older
+    on 1 March in non-leap years)
+
+    Args:
+        birthdays (iterable): pairs (month, day) of birth dates of citizens
+        today (datetime.date): day ages are counted for (current one if None)
+
+    Returns:
+        (datetime.date): the first date ages differ from today's ones or None if there are no birthdays
+    """
+    today = today or datetime.date.today()
+    next_date = None
+    for month, day in birthdays:
+        for year in (today.year, today.year + 1):
+            if month == 2 and day == 29 and not calendar.isleap(year):
+                date = datetime.date(year, 3, 1)
+            else:
+                date = datetime.date(year, month, day)
+            if date > today:
+                break
+        if next_date is None or date < next_date:
+            next_date = date
+    return next_date
+
+
+def _to_days(birth_dates):
+    # python dates to days since epoch
+    if isinstance(birth_dates, numpy.ndarray):
+        return birth_dates.astype('datetime64[D]').astype(numpy.int64)
+    ordinals = numpy.fromiter(map(datetime.date.toordinal, birth_dates), numpy.int64, len(birth_dates))
+    return ordinals - _EPOCH_ORDINAL
+
+
+def _factorize(towns):
+    # names of towns in sorted order and index of town of every row in them
+    codes = dict.fromkeys(towns)
+    town_names = sorted(codes)
+    for code, town in enumerate(town_names):
+        codes[town] = code
+    return town_names, numpy.fromiter(map(codes.__getitem__, towns), numpy.int64, len(towns))
+
+
+def _lerp(a, b, t):
+    # interpolation between neighbour values the same way as numpy.percentile does it since numpy 1.22 (older
+    # versions differ in the last digits)
+    diff = b - a
+    return numpy.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+
+def sorted_percentiles(size, value_at, percents=PERCENTS):
+    """
+    Compute percentiles of sorted values with linear interpolation reading only values they are interpolated
+    between
+
+    Args:
+        size (int): number of values
+        value_at (function): value (int) by its position in ascending order
+        percents (tuple): percentiles to compute
+
+    Returns:
+        (numpy.ndarray): percentiles in order of percents
+    """
+    quantiles = numpy.asarray(percents, dtype=numpy.float64) / 100
+    positions = (size - 1) * quantiles
+    previous = numpy.floor(positions).astype(numpy.int64)
+    following = numpy.minimum(previous + 1, size - 1)
+    lower = numpy.array([value_at(position) for position in previous.tolist()], dtype=numpy.int64)
+    upper = numpy.array([value_at(position) for position in following.tolist()], dtype=numpy.int64)
+    return _lerp(lower, upper, positions - previous)
+
+
+def town_percentiles(towns, birth_dates, counts=None, percents=PERCENTS, today=None):
+    """
+    Compute percentiles of ages of citizens of every town with linear interpolation
+
+    Args:
+        towns (sequence): town of every row
+        birth_dates (sequence): birth date of every row (datetime.date or datetime64[D])
+        counts (sequence): number of citizens of every row (one citizen per row if None)
+        percents (tuple): percentiles to compute
+        today (datetime.date): day to count ages for (current one if None)
+
+    Returns:
+        (list): pairs (town, array of percentiles in order of percents) in order of towns' names
+    """
+    if not len(towns):
+        return []
+    days = _to_days(birth_dates)
+    town_names, town_index = _factorize(towns)
+
+    # ages of every day between the first and the last birth dates - there are much less days than citizens
+    first_day = days.min()
+    day_ages = get_ages(numpy.arange(first_day, days.max() + 1).astype('datetime64[D]'), today)
+    min_age = day_ages.min()
+    age_span = day_ages.max() - min_age + 1
+    ages = day_ages[days - first_day] - min_age
+
+    # the only sort: by town, then by age (both are in one key)
+    keys = town_index * age_span + ages
+    if counts is None:
+        sorted_keys = numpy.sort(keys)
+        sizes = numpy.bincount(town_index, minlength=len(town_names))
+    else:
+        counts = numpy.fromiter(counts, numpy.int64, len(counts))
+        order = numpy.argsort(keys)
+        sorted_keys = numpy.repeat(keys[order], counts[order])
+        sizes = numpy.bincount(town_index, weights=counts, minlength=len(town_names)).astype(numpy.int64)
+    sorted_ages = sorted_keys % age_span + min_age
+    starts = numpy.concatenate(([0], numpy.cumsum(sizes)[:-1]))
+
+    # positions of percentiles in every segment (as numpy.percentile with linear interpolation)
+    quantiles = numpy.asarray(percents, dtype=numpy.float64) / 100
+    positions = (sizes[:, None] - 1) * quantiles[None, :]
+    previous = numpy.floor(positions).astype(numpy.int64)
+    following = numpy.minimum(previous + 1, sizes[:, None] - 1)
+    values = _lerp(sorted_ages[starts[:, None] + previous], sorted_ages[starts[:, None] + following],
+                   positions - previous)
+    return list(zip(town_names, values))
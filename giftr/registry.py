@@ -0,0 +1,188 @@
+"""
+Registry of existing sets of citizens kept in memory of every process
+
+Registry knows import ids and numbers of citizens of sets from imports table, so endpoints find out that set doesn't
+exist without any query. Sets inserted by this process are added right after commit, sets inserted by other
+processes are loaded by refresh that selects only ids greater than already known ones. Imports of different
+processes may commit out of order, so ids not greater than the maximal known one by less than
+IMPORT_REGISTRY_WINDOW (32 by default) are rechecked by refresh too. Older unknown ids (of imports that committed
+even later) are looked for in imports table one by one.
+
+Ids that aren't positive integers are rejected without any query. Other unknown ids cost one query and are
+remembered as missing (up to IMPORT_REGISTRY_MISSES ids, 1024 by default), so repeated requests of them make no
+queries until a set with greater id becomes known or IMPORT_REGISTRY_MISS_TTL seconds pass (1 by default) - import
+of other process that has taken the id but hasn't committed yet becomes visible no later than that.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import select
+
+from .models import db, Imports
+from .exceptions import SetNotFoundError
+
+
+class ImportRegistry:
+    """
+    Import ids of existing sets with numbers of their citizens
+    """
+    def __init__(self, window, misses=1024, miss_ttl=1.0):
+        self.window = window
+        self.misses = misses
+        self.miss_ttl = miss_ttl
+        self._counts = dict()
+        self._max_known = 0
+        # unknown id -> time it was found missing (in order of finding)
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _known(self, import_id, citizens_count):
+        # misses are out of date when set with greater id appears
+        self._counts[import_id] = citizens_count
+        if import_id > self._max_known:
+            self._max_known = import_id
+            self._missing.clear()
+
+    def _is_missing(self, import_id):
+        with self._lock:
+            found_at = self._missing.get(import_id)
+            if found_at is None:
+                return False
+            if time.monotonic() - found_at > self.miss_ttl:
+                del self._missing[import_id]
+                return False
+            return True
+
+    def _add_missing(self, import_id):
+        with self._lock:
+            self._missing.pop(import_id, None)
+            self._missing[import_id] = time.monotonic()
+            while len(self._missing) > self.misses:
+                self._missing.popitem(last=False)
+
+    def refresh(self):
+        """
+        Load sets inserted after the last refresh (and the last ones before it)
+        """
+        start = self._max_known - self.window
+        rows = db.session.execute(select([Imports.import_id, Imports.citizens_count])
+                                  .where(Imports.import_id > start)).fetchall()
+        with self._lock:
+            for import_id, citizens_count in rows:
+                self._known(import_id, citizens_count)
+
+    def lookup(self, import_id):
+        """
+        Load one set by its import id
+
+        Returns:
+            (bool): True if set is found
+        """
+        row = db.session.execute(select([Imports.citizens_count]).where(Imports.import_id == import_id)).first()
+        if row is None:
+            return False
+        with self._lock:
+            self._known(import_id, row[0])
+        return True
+
+    def add(self, import_id, citizens_count):
+        """
+        Add just inserted set
+        """
+        with self._lock:
+            self._known(import_id, citizens_count)
+
+    def citizens_count(self, import_id):
+        """
+        Get number of citizens in set
+
+        Args:
+            import_id (int): import id of set
+
+        Returns:
+            (int): number of citizens, None if it is unknown (for sets inserted by previous versions that haven't
+            been upgraded) or -1 if there is no such set
+        """
+        if import_id in self._counts:
+            return self._counts[import_id]
+        if import_id <= 0 or self._is_missing(import_id):
+            return -1
+        if import_id > self._max_known - self.window:
+            self.refresh()
+        else:
+            # import committed after sets far beyond it
+            self.lookup(import_id)
+        if import_id in self._counts:
+            return self._counts[import_id]
+        self._add_missing(import_id)
+        return -1
+
+    def clear(self):
+        """
+        Forget all sets
+        """
+        with self._lock:
+            self._counts.clear()
+            self._missing.clear()
+            self._max_known = 0
+
+
+def get_registry(app=None):
+    """
+    Get registry of application creating it on first use
+
+    Args:
+        app: flask application (current one if None)
+
+    Returns:
+        (ImportRegistry): registry of application
+    """
+    app = app or current_app
+    if 'import_registry' not in app.extensions:
+        app.extensions['import_registry'] = ImportRegistry(app.config.get('IMPORT_REGISTRY_WINDOW', 32),
+                                                           app.config.get('IMPORT_REGISTRY_MISSES', 1024),
+                                                           app.config.get('IMPORT_REGISTRY_MISS_TTL', 1.0))
+    return app.extensions['import_registry']
+
+
+def find(import_id):
+    """
+    Find set of citizens
+
+    Args:
+        import_id: import id of set (integer or string as it is given by client)
+
+    Returns:
+        (int): import id of set or None if import_id isn't integer or there is no set with citizens with such id
+        (sets of unknown size are supposed to exist)
+    """
+    if not isinstance(import_id, int):
+        if not (import_id.isascii() and import_id.isdigit()):
+            return None
+        import_id = int(import_id)
+    citizens_count = get_registry().citizens_count(import_id)
+    if citizens_count is not None and citizens_count <= 0:
+        return None
+    return import_id
+
+
+def check_exists(import_id):
+    """
+    Check that set of citizens exists
+
+    Args:
+        import_id: import id of set (integer or string as it is given by client)
+
+    Returns:
+        (int): import id of set
+
+    Raises:
+        SetNotFoundError: if import_id isn't integer or there is no set with citizens with such id
+    """
+    found = find(import_id)
+    if found is None:
+        current_app.logger.info("import with import_id = {} does not exist".format(import_id))
+        raise (SetNotFoundError("import with import_id = {} does not exist".format(import_id)))
+    return found
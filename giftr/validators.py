@@ -0,0 +1,192 @@
+"""
+Compilation of json-schemas to plain python check functions
+
+Only keywords that are used by schemas of the application are supported: type, properties, required,
+additionalProperties, items, enum and anyOf. Schema is compiled once to a tree of closures, each of them checks its
+part of the instance without looking into the schema again. Error messages are formed the same way jsonschema
+forms them, path to the wrong value is added to the message.
+"""
+
+SUPPORTED_KEYWORDS = {"type", "properties", "required", "additionalProperties", "items", "enum", "anyOf"}
+
+
+class SchemaError(Exception):
+    """Schema can't be compiled"""
+
+
+class ValidationError(ValueError):
+    """
+    Instance doesn't match the schema
+
+    Attributes:
+        message (str): what is wrong with the value
+        path (list): keys and indexes that lead to the wrong value from the root of instance
+    """
+    def __init__(self, message):
+        super(ValidationError, self).__init__(message)
+        self.message = message
+        self.path = list()
+
+    def __str__(self):
+        if not self.path:
+            return self.message
+        path = "".join("[{!r}]".format(step) for step in self.path)
+        return "{} (on instance{})".format(self.message, path)
+
+
+def _is_integer(value):
+    # the same as jsonschema does - bool is not integer, float without fraction is
+    if isinstance(value, int):
+        return not isinstance(value, bool)
+    return isinstance(value, float) and value.is_integer()
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+_TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "integer": _is_integer,
+    "number": _is_number,
+    "boolean": lambda value: isinstance(value, bool),
+    "null": lambda value: value is None,
+}
+
+
+def _compile_type(type_name):
+    if type_name not in _TYPE_CHECKS:
+        raise (SchemaError("Unknown type {!r}".format(type_name)))
+    # most common types are checked with exact type comparison first
+    exact_types = {"object": dict, "array": list, "string": str, "integer": int}
+    is_type = _TYPE_CHECKS[type_name]
+    exact_type = exact_types.get(type_name)
+
+    def check_type(instance):
+        if type(instance) is not exact_type and not is_type(instance):
+            raise (ValidationError("{!r} is not of type {!r}".format(instance, type_name)))
+    return check_type
+
+
+def _compile_object(schema):
+    properties = [(name, compile_schema(subschema)) for name, subschema in schema.get("properties", {}).items()]
+    required = list(schema.get("required", []))
+    required_set = frozenset(required)
+    additional = schema.get("additionalProperties", True)
+    if additional not in (True, False):
+        raise (SchemaError("Only boolean additionalProperties is supported"))
+    allowed = frozenset(name for name, _ in properties)
+    # without type keyword object keywords are ignored for not objects as jsonschema does
+    typed = schema.get("type") == "object"
+
+    def check_object(instance):
+        if not typed and not isinstance(instance, dict):
+            return
+        keys = instance.keys()
+        if not required_set <= keys:
+            missing = next(name for name in required if name not in instance)
+            raise (ValidationError("{!r} is a required property".format(missing)))
+        if not additional and not keys <= allowed:
+            extra = sorted(key for key in instance if key not in allowed)
+            verb = "was" if len(extra) == 1 else "were"
+            raise (ValidationError("Additional properties are not allowed ({} {} unexpected)"
+                                   .format(", ".join(repr(key) for key in extra), verb)))
+        for name, check in properties:
+            if name in instance:
+                try:
+                    check(instance[name])
+                except ValidationError as e:
+                    e.path.insert(0, name)
+                    raise
+    return check_object
+
+
+def _compile_array(schema):
+    check_item = compile_schema(schema["items"])
+    typed = schema.get("type") == "array"
+
+    def check_array(instance):
+        if not typed and not isinstance(instance, list):
+            return
+        index = 0
+        try:
+            for index, item in enumerate(instance):
+                check_item(item)
+        except ValidationError as e:
+            e.path.insert(0, index)
+            raise
+    return check_array
+
+
+def _compile_enum(values):
+    allowed = list(values)
+
+    def check_enum(instance):
+        if instance not in allowed:
+            raise (ValidationError("{!r} is not one of {!r}".format(instance, allowed)))
+    return check_enum
+
+
+def _compile_any_of(schemas):
+    checks = [compile_schema(subschema) for subschema in schemas]
+
+    def check_any_of(instance):
+        for check in checks:
+            try:
+                check(instance)
+                return
+            except ValidationError:
+                pass
+        raise (ValidationError("{!r} is not valid under any of the given schemas".format(instance)))
+    return check_any_of
+
+
+def compile_schema(schema):
+    """
+    Compile json-schema to check function
+
+    Args:
+        schema (dict): json-schema
+
+    Returns:
+        (function): function that takes instance to check and raises ValidationError if instance doesn't match
+        the schema
+
+    Raises:
+        SchemaError: if schema contains keywords that are not supported
+    """
+    unsupported = set(schema) - SUPPORTED_KEYWORDS
+    if unsupported:
+        raise (SchemaError("Unsupported keywords: {}".format(", ".join(sorted(unsupported)))))
+
+    checks = list()
+    # keywords are checked in this order, so the first error is the most general one
+    if "type" in schema:
+        checks.append(_compile_type(schema["type"]))
+    if "anyOf" in schema:
+        checks.append(_compile_any_of(schema["anyOf"]))
+    if "enum" in schema:
+        checks.append(_compile_enum(schema["enum"]))
+    if schema.get("type") == "object" or "properties" in schema or "required" in schema:
+        checks.append(_compile_object(schema))
+    if "items" in schema:
+        checks.append(_compile_array(schema))
+
+    if not checks:
+        return lambda instance: None
+    if len(checks) == 1:
+        return checks[0]
+    if len(checks) == 2:
+        first, second = checks
+
+        def check_two(instance):
+            first(instance)
+            second(instance)
+        return check_two
+
+    def check_all(instance):
+        for check in checks:
+            check(instance)
+    return check_all
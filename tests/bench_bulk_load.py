@@ -0,0 +1,87 @@
+import sys
+import os
+import time
+import random
+import datetime
+import tempfile
+
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr.models import db, Citizens, Kinships  # noqa: E402
+from giftr import bulk_load  # noqa: E402
+
+"""
+Benchmark: insert of citizens and kinships rows with loader chosen by dialect against insert of list of dicts
+
+Run from tests folder:
+    python bench_bulk_load.py [database uri]
+Temporary SQLite database is used if uri isn't given. Tables are created if they don't exist, inserted rows are
+rolled back.
+"""
+
+SIZES = (10000, 100000)
+
+
+def generate_rows(size):
+    """
+    Generate rows for citizens and kinships tables (without import_id)
+
+    Args:
+        size (int): number of citizens
+
+    Returns:
+        citizens_rows (list), kinships_rows (list): rows in order of get_keys() of models
+    """
+    citizens_rows = list()
+    kinships_rows = list()
+    for citizen_id in range(1, size + 1):
+        birth_date = datetime.datetime(random.randint(1950, 2007), random.randint(1, 12), random.randint(1, 28))
+        citizens_rows.append([citizen_id, "Москва", "Льва Толстого", "16к7стр5", random.randint(1, 150),
+                              "Иванов Иван Иванович", birth_date, random.choice(["male", "female"])])
+        if citizen_id % 2 == 0:
+            kinships_rows.append([citizen_id - 1, citizen_id])
+    return citizens_rows, kinships_rows
+
+
+def timed_load(loader, citizens_rows, kinships_rows):
+    """
+    Load rows in one transaction and roll it back
+
+    Returns:
+        (float): time of loading in seconds
+    """
+    start = time.perf_counter()
+    loader.load(db.session, Citizens, 1, citizens_rows)
+    loader.load(db.session, Kinships, 1, kinships_rows)
+    db.session.flush()
+    elapsed = time.perf_counter() - start
+    db.session.rollback()
+    return elapsed
+
+
+def main():
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    else:
+        uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        dialect_loader = bulk_load.get_loader(db.session)
+        default_loader = bulk_load.DefaultLoader(db.session.get_bind().dialect)
+        print("database: {}, loader: {}".format(db.session.get_bind().dialect.name, type(dialect_loader).__name__))
+        for size in SIZES:
+            citizens_rows, kinships_rows = generate_rows(size)
+            default_time = timed_load(default_loader, citizens_rows, kinships_rows)
+            dialect_time = timed_load(dialect_loader, citizens_rows, kinships_rows)
+            print("{:>7} citizens: list of dicts {:.3f}s, {} {:.3f}s, speedup x{:.1f}"
+                  .format(size, default_time, type(dialect_loader).__name__, dialect_time,
+                          default_time / dialect_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import sys
+import os
+import time
+import random
+import tempfile
+
+from flask import Flask
+from sqlalchemy import select
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr.models import db, Citizens, Kinships, Imports  # noqa: E402
+from giftr import db_helper, bulk_load  # noqa: E402
+from bench_bulk_load import generate_rows  # noqa: E402
+
+"""
+Benchmark: get of citizens set with relatives aggregated by db in one query against two queries (citizens, then
+kinships) merged in python
+
+Run from tests folder:
+    python bench_citizens_query.py [database uri]
+Temporary SQLite database is used if uri isn't given. Tables are created if they don't exist, inserted rows are
+rolled back.
+"""
+
+SIZES = (10000, 100000)
+REPEATS = 3
+
+
+def add_random_kinships(kinships_rows, size):
+    """
+    Add some more relative pairs (every pair once with smaller id first)
+    """
+    pairs = set(tuple(row) for row in kinships_rows)
+    for _ in range(size):
+        a, b = sorted(random.sample(range(1, size + 1), 2))
+        pairs.add((a, b))
+    return [list(pair) for pair in sorted(pairs)]
+
+
+def get_citizens_set_two_queries(import_id_):
+    """
+    Get set of citizens the way it had been done before - citizens and kinships by separate queries
+    """
+    citizens_responce = Citizens.query.filter_by(import_id=import_id_).order_by(Citizens.citizen_id).all()
+    citizens_dict = {citizen.citizen_id: citizen.serialize() for citizen in citizens_responce}
+    pairs = db_helper.kinship_pairs(import_id_)
+    kinship_response = db.session.execute(select([pairs.c.citizen_id, pairs.c.relative_id])).fetchall()
+    for citizen_id, relative_id in kinship_response:
+        citizens_dict[citizen_id]["relatives"].append(relative_id)
+    for citizen in citizens_dict.values():
+        citizen["relatives"].sort()
+    return {"data": list(citizens_dict.values())}
+
+
+def best_time(func, import_id):
+    """
+    Returns:
+        (float): the best time of REPEATS calls in seconds, result (dict): result of the last call
+    """
+    best = None
+    result = None
+    for _ in range(REPEATS):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        result = func(import_id)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    else:
+        uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        loader = bulk_load.get_loader(db.session)
+        print("database: {}".format(db.session.get_bind().dialect.name))
+        for size in SIZES:
+            citizens_rows, kinships_rows = generate_rows(size)
+            kinships_rows = add_random_kinships(kinships_rows, size)
+            # set is found by registry of sets by its row in imports table
+            db.session.add(Imports(import_id=1, citizens_count=size))
+            loader.load(db.session, Citizens, 1, citizens_rows)
+            loader.load(db.session, Kinships, 1, kinships_rows)
+            db.session.flush()
+            two_queries_time, expected = best_time(get_citizens_set_two_queries, 1)
+            one_query_time, got = best_time(db_helper.get_citizens_set, 1)
+            assert got == expected
+            db.session.rollback()
+            print("{:>7} citizens: two queries {:.3f}s, one query {:.3f}s, speedup x{:.1f}"
+                  .format(size, two_queries_time, one_query_time, two_queries_time / one_query_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import sys
+import os
+import time
+import random
+import datetime
+from collections import Counter
+
+from numpy import percentile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import help_data, percentiles  # noqa: E402
+
+"""
+Benchmark: percentiles of ages by towns computed in python loop (as before) and by vectorized engine
+
+Run from tests folder:
+    python bench_percentiles.py
+Rows are computed both per citizen and as distribution of birth dates in towns (as it is kept in db). The target
+speedup x10 isn't reached: rows per citizen give about x8-12, distribution (that the service reads) - about x6-9,
+most of the rest is conversion of python objects of rows to arrays.
+"""
+
+SIZE = 1000000
+TARGET_SPEEDUP = 10
+TOWNS = 100
+REPEATS = 3
+
+
+def generate_citizens(size):
+    """
+    Returns:
+        towns (list), birth_dates (list): town and birth date of every citizen
+    """
+    towns = ["Город {}".format(random.randrange(TOWNS)) for _ in range(size)]
+    start = datetime.date(1930, 1, 1).toordinal()
+    end = datetime.date(2019, 12, 31).toordinal()
+    birth_dates = [datetime.date.fromordinal(random.randint(start, end)) for _ in range(size)]
+    return towns, birth_dates
+
+
+def loop_percentiles(towns, birth_dates, counts):
+    age_dict = dict()
+    for town, birth_date, citizens in zip(towns, birth_dates, counts):
+        age_dict.setdefault(town, []).extend([help_data.get_age(birth_date)] * citizens)
+    return [(town, percentile(ages, [50, 75, 99], interpolation='linear')) for town, ages in age_dict.items()]
+
+
+def best_time(func, *args):
+    """
+    Returns:
+        best (float), result: the best time of REPEATS calls in seconds and result of the last one
+    """
+    best, result = None, None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    towns, birth_dates = generate_citizens(SIZE)
+    distribution = Counter(zip(towns, birth_dates))
+    rows = {
+        "citizens": (towns, birth_dates, None),
+        "distribution": tuple(map(list, zip(*((town, date, count) for (town, date), count in distribution.items())))),
+    }
+    print("{} citizens, {} towns, {} distinct (town, birth date)".format(SIZE, TOWNS, len(distribution)))
+    for name, (towns, birth_dates, counts) in rows.items():
+        loop_time, expected = best_time(loop_percentiles, towns, birth_dates, counts or [1] * len(towns))
+        engine_time, result = best_time(percentiles.town_percentiles, towns, birth_dates, counts)
+        expected = dict((town, list(values)) for town, values in expected)
+        assert dict((town, list(values)) for town, values in result) == expected
+        speedup = loop_time / engine_time
+        print("{:>12}: loop {:.3f}s, vectorized {:.3f}s, x{:.1f} (target x{} {})".format(
+            name, loop_time, engine_time, speedup, TARGET_SPEEDUP,
+            "reached" if speedup >= TARGET_SPEEDUP else "missed"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import sys
+import os
+import time
+import tempfile
+
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr.models import db, Citizens, Kinships, Imports  # noqa: E402
+from giftr import db_helper, bulk_load, dates  # noqa: E402
+from bench_bulk_load import generate_rows  # noqa: E402
+from bench_citizens_query import add_random_kinships  # noqa: E402
+
+"""
+Benchmark: throughput of read paths of db_helper (citizens per second)
+
+Run from tests folder:
+    python bench_read_paths.py [database uri]
+Temporary SQLite database is used if uri isn't given. Tables are created if they don't exist, inserted rows are
+rolled back.
+"""
+
+SIZE = 100000
+REPEATS = 3
+
+
+def read_paths():
+    """
+    Returns:
+        (list): pairs (name, function of import_id reading the whole set)
+    """
+    return [
+        ("get_citizens_set", lambda import_id: db_helper.get_citizens_set(import_id)),
+        ("iter_citizens_set", lambda import_id: list(db_helper.iter_citizens_set(import_id))),
+        ("get_citizens_columns", lambda import_id: db_helper.get_citizens_columns(import_id)),
+        ("get_citizens_page x100", lambda import_id: [db_helper.get_citizens_page(import_id, SIZE // 100, after)
+                                                      for after in range(0, SIZE, SIZE // 100)]),
+    ]
+
+
+def best_time(func, import_id):
+    """
+    Returns:
+        (float): the best time of REPEATS calls in seconds
+    """
+    best = None
+    for _ in range(REPEATS):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        func(import_id)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    if len(sys.argv) > 1:
+        uri = sys.argv[1]
+    else:
+        uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        loader = bulk_load.get_loader(db.session)
+        print("database: {}, {} citizens".format(db.session.get_bind().dialect.name, SIZE))
+        citizens_rows, kinships_rows = generate_rows(SIZE)
+        kinships_rows = add_random_kinships(kinships_rows, SIZE)
+        # set is found by registry of sets by its row in imports table
+        db.session.add(Imports(import_id=1, citizens_count=SIZE))
+        loader.load(db.session, Citizens, 1, citizens_rows)
+        loader.load(db.session, Kinships, 1, kinships_rows)
+        db.session.flush()
+        for name, func in read_paths():
+            elapsed = best_time(func, 1)
+            print("{:>24}: {:.3f}s, {:>8.0f} citizens/s".format(name, elapsed, SIZE / elapsed))
+        birth_dates = [row[6] for row in citizens_rows]
+        for name, func in (("format_date per row", lambda: [dates.format_date(date) for date in birth_dates]),
+                           ("format_dates", lambda: dates.format_dates(birth_dates))):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            print("{:>24}: {:.3f}s, {:>8.0f} dates/s".format(name, elapsed, SIZE / elapsed))
+        db.session.rollback()
+
+
+if __name__ == '__main__':
+    main()
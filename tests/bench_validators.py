@@ -0,0 +1,76 @@
+import sys
+import os
+import time
+import random
+
+import jsonschema
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import help_data, validators  # noqa: E402
+
+"""
+Micro-benchmark: compiled validators against jsonschema.validate for citizens sets of different sizes
+
+Run from tests folder:
+    python bench_validators.py
+"""
+
+SIZES = (10000, 100000)
+REPEAT = 3
+
+
+def generate_citizens_set(size):
+    """
+    Generate valid citizens set (relatives connect neighbours in pairs)
+
+    Args:
+        size (int): number of citizens in set
+
+    Returns:
+        (dict): citizens set as it comes to insert interface
+    """
+    citizens = list()
+    for citizen_id in range(1, size + 1):
+        relative = citizen_id + 1 if citizen_id % 2 else citizen_id - 1
+        citizens.append({
+            "citizen_id": citizen_id,
+            "town": random.choice(["Москва", "Керчь", "Самара"]),
+            "street": "Льва Толстого",
+            "building": "16к7стр5",
+            "apartment": random.randint(1, 150),
+            "name": "Иванов Иван Иванович",
+            "birth_date": "{:02d}.{:02d}.{}".format(random.randint(1, 28), random.randint(1, 12),
+                                                   random.randint(1950, 2007)),
+            "gender": random.choice(["male", "female"]),
+            "relatives": [relative] if relative <= size else []
+        })
+    return {"citizens": citizens}
+
+
+def best_time(func, *args):
+    """
+    Best of REPEAT runs of func(*args) in seconds
+    """
+    times = list()
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    start = time.perf_counter()
+    check_insert = validators.compile_schema(help_data.schema_input)
+    compile_time = time.perf_counter() - start
+    print("compilation of schema_input: {:.6f}s".format(compile_time))
+    for size in SIZES:
+        citizens_set = generate_citizens_set(size)
+        jsonschema_time = best_time(jsonschema.validate, citizens_set, help_data.schema_input)
+        compiled_time = best_time(check_insert, citizens_set)
+        print("{:>7} citizens: jsonschema {:.3f}s, compiled {:.3f}s, speedup x{:.1f}"
+              .format(size, jsonschema_time, compiled_time, jsonschema_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import sys
+import os
+import random
+from bisect import insort
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import age_index  # noqa: E402
+
+"""
+File contains tests of sorted blocks of dates of age index: after any inserts and removes they have to hold the same
+dates as one sorted list (run from tests folder, server isn't needed)
+"""
+
+
+def assert_same(dates, expected):
+    assert len(dates) == len(expected)
+    assert [dates[position] for position in range(len(dates))] == expected
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sorted_dates_as_sorted_list(seed, monkeypatch):
+    # small blocks to split and empty them often
+    monkeypatch.setattr(age_index, "BLOCK_SIZE", 4)
+    rng = random.Random(seed)
+    expected = sorted(rng.randrange(700000, 700050) for _ in range(rng.randrange(0, 30)))
+    dates = age_index.SortedDates(expected)
+    assert_same(dates, expected)
+    for _ in range(2000):
+        if expected and rng.random() < 0.5:
+            ordinal = rng.choice(expected)
+            expected.remove(ordinal)
+            dates.remove(ordinal)
+        else:
+            ordinal = rng.randrange(700000, 700050)
+            insort(expected, ordinal)
+            dates.add(ordinal)
+        assert_same(dates, expected)
+
+
+def test_sorted_dates_remove_absent(monkeypatch):
+    monkeypatch.setattr(age_index, "BLOCK_SIZE", 2)
+    dates = age_index.SortedDates([1, 2, 2, 5, 7])
+    for ordinal in (0, 3, 8):
+        with pytest.raises(KeyError):
+            dates.remove(ordinal)
+    dates.remove(2)
+    dates.remove(2)
+    with pytest.raises(KeyError):
+        dates.remove(2)
+    assert_same(dates, [1, 5, 7])
@@ -0,0 +1,165 @@
+import sys
+import os
+import datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy import column, update
+from sqlalchemy.dialects import postgresql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import db_helper, age_index  # noqa: E402
+from giftr.models import db, Imports  # noqa: E402
+from test import get_test_file_as_structure, get_percentile, approx_statistic, town_key  # noqa: E402
+
+"""
+File contains tests of db_helper in cases http tests can't make: postgresql dialect is checked by queries compiled
+for it and by running the rest of code path on sqlite, patches of other processes are made in the middle of request
+(run from tests folder, server isn't needed)
+
+Tests of postgresql itself run only if uri of its empty test database is given in environment variable
+GIFTS_TEST_POSTGRES_URI (tables are created and dropped by them), otherwise they are skipped.
+"""
+
+POSTGRES_URI = os.environ.get('GIFTS_TEST_POSTGRES_URI')
+
+
+@pytest.fixture
+def app_context():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield
+
+
+@pytest.fixture
+def postgres_context():
+    if not POSTGRES_URI:
+        pytest.skip("GIFTS_TEST_POSTGRES_URI isn't given")
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = POSTGRES_URI
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield
+        db.session.remove()
+        db.drop_all()
+
+
+def compile_postgresql(expression):
+    return str(expression.compile(dialect=postgresql.dialect()))
+
+
+def test_array_agg_compiled():
+    aggregate, parse = db_helper.relatives_aggregate('postgresql', column('relative_id'))
+    assert compile_postgresql(aggregate) == "array_agg(relative_id ORDER BY relative_id)"
+    assert parse([1, 2]) == [1, 2]
+    # citizen without relatives
+    assert parse(None) == []
+
+
+def test_array_agg_path_with_citizen_without_relatives(app_context, monkeypatch):
+    relatives_aggregate = db_helper.relatives_aggregate
+
+    def array_agg_like(dialect_name, relative_id):
+        # array_agg isn't in sqlite: group_concat gives NULL the same way and its value is turned to array
+        aggregate, parse = relatives_aggregate('sqlite', relative_id)
+        return aggregate, lambda value: db_helper._parse_array_agg(None if value is None else parse(value))
+    monkeypatch.setattr(db_helper, "relatives_aggregate", array_agg_like)
+
+    request_json = get_test_file_as_structure('test_files/data_set_to_patch_it.test')
+    import_id = db_helper.insert_citizens_set(request_json)
+    expected = {citizen["citizen_id"]: sorted(citizen["relatives"]) for citizen in request_json["citizens"]}
+    assert [] in expected.values()
+
+    data = db_helper.get_citizens_set(import_id)["data"]
+    assert {citizen["citizen_id"]: citizen["relatives"] for citizen in data} == expected
+
+
+def test_percentile_cont_compiled():
+    query = db_helper.percentiles_query(1, datetime.date(2019, 8, 30))
+    sql = " ".join(compile_postgresql(query).split())
+    assert ("percentile_cont(CAST(ARRAY[%(param_1)s, %(param_2)s, %(param_3)s] AS FLOAT[])) "
+            "WITHIN GROUP (ORDER BY date_part(%(date_part_1)s, age(%(param_4)s, citizens.birth_date)))") in sql
+    assert sql.endswith("WHERE citizens.import_id = %(import_id_1)s GROUP BY citizens.town")
+    params = query.compile(dialect=postgresql.dialect()).params
+    assert [params["param_1"], params["param_2"], params["param_3"]] == [0.5, 0.75, 0.99]
+    assert params["param_4"] == datetime.date(2019, 8, 30)
+
+
+def test_age_index_built_during_patch_isnt_kept(app_context, monkeypatch):
+    import_id = db_helper.insert_citizens_set(get_test_file_as_structure('test_files/data_set_to_patch_it.test'))
+    from_distribution = age_index.TownAgeIndex.from_distribution
+
+    def patched_meanwhile(version, distribution):
+        # other process patches set after version is read
+        db.session.execute(update(Imports).where(Imports.import_id == import_id).values(version=Imports.version + 1))
+        db.session.commit()
+        return from_distribution(version, distribution)
+    monkeypatch.setattr(age_index.TownAgeIndex, "from_distribution", patched_meanwhile)
+
+    db_helper.percentiles_from_index(import_id)
+    store = age_index.get_store()
+    assert store.percentiles(import_id, 0) is None
+    assert store.percentiles(import_id, 1) is None
+
+    monkeypatch.setattr(age_index.TownAgeIndex, "from_distribution", from_distribution)
+    expected = db_helper.percentiles_from_index(import_id)
+    assert [(town, list(values)) for town, values in store.percentiles(import_id, 1)] == \
+        [(town, list(values)) for town, values in expected]
+
+
+def test_age_index_follows_patches_of_any_fields(app_context):
+    import_id = db_helper.insert_citizens_set(get_test_file_as_structure('test_files/data_set_to_patch_it.test'))
+    store = age_index.get_store()
+    db_helper.percentiles_from_index(import_id)
+    patches = [{"name": "Иванов Пётр"}, {"relatives": []}, {"town": "Керчь"}, {"birth_date": "01.01.1950"},
+               {"street": "Ленина", "town": "Москва"}]
+    for version, patch in enumerate(patches, start=1):
+        db_helper.fix_data(import_id, 1, patch)
+        # index isn't built again - it is moved by patch to its version
+        got = store.percentiles(import_id, version)
+        assert got is not None
+        expected = db_helper.percentiles_in_python(import_id)
+        assert [(town, list(values)) for town, values in got] == [(town, list(values)) for town, values in expected]
+
+
+def test_relatives_are_read_by_patch_only_if_present_counts_change(app_context, monkeypatch):
+    import_id = db_helper.insert_citizens_set(get_test_file_as_structure('test_files/data_set_to_patch_it.test'))
+    kinship_pairs = db_helper.kinship_pairs
+    calls = list()
+
+    def counted_kinship_pairs(import_id_, citizen_id_=None):
+        calls.append(citizen_id_)
+        return kinship_pairs(import_id_, citizen_id_)
+    monkeypatch.setattr(db_helper, "kinship_pairs", counted_kinship_pairs)
+
+    # response without relatives doesn't need them either
+    db_helper.fix_data(import_id, 1, {"name": "Иванов Пётр", "town": "Керчь"}, fields=("citizen_id", "name"))
+    assert calls == []
+    db_helper.fix_data(import_id, 1, {"birth_date": "01.01.1950"})
+    assert 1 in calls
+    calls.clear()
+    db_helper.fix_data(import_id, 1, {"relatives": []})
+    assert 1 in calls
+
+
+@pytest.mark.parametrize("data_set_file", ['test_files/data_set_for_percentile2.test',
+                                           'test_files/good_and_big_set.test'])
+def test_percentiles_parity_on_postgresql(postgres_context, data_set_file):
+    # percentile_cont of db and numpy of service have to give the same as numpy gives for every town
+    request_json = get_test_file_as_structure(data_set_file)
+    expected = approx_statistic(get_percentile(request_json)["data"])
+    import_id = db_helper.insert_citizens_set(request_json)
+    assert db.session.get_bind().dialect.name == 'postgresql'
+    for town_percentiles in (db_helper.percentiles_in_db(import_id), db_helper.percentiles_in_python(import_id)):
+        got = [{"town": town, "p50": values[0], "p75": values[1], "p99": values[2]}
+               for town, values in town_percentiles]
+        assert sorted(got, key=town_key) == expected
+    got = db_helper.get_statistic_for_import_id(import_id)["data"]
+    assert sorted(got, key=town_key) == expected
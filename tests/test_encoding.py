@@ -0,0 +1,43 @@
+import sys
+import os
+import json
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import encoding  # noqa: E402
+
+"""
+File contains tests of json encoders: output of every installed one has to be decoded to the same values (run from
+tests folder, server isn't needed)
+"""
+
+ENCODERS = ["orjson", "ujson", "json"]
+
+# percentile response and floats which notation differs between encoders
+FLOAT_DATA = {
+    "data": [
+        {"town": "Москва", "p50": numpy.float64(33.5), "p75": numpy.float64(40.25), "p99": numpy.float64(64.97)},
+        {"town": "Керчь", "p50": numpy.float64(0.0), "p75": numpy.int64(7), "p99": 12.009999999999998},
+    ],
+    "floats": [1e22, 1e-7, 1.5e300, -2.5e-300, 0.1 + 0.2, 1 / 3, 123456789.123, -0.0, 5e-324],
+}
+
+
+def encode(name, obj):
+    pytest.importorskip(name)
+    return encoding.get_encoder(name)[1](obj)
+
+
+@pytest.mark.parametrize("name", ENCODERS)
+def test_encoders_give_the_same_floats(name):
+    expected = json.loads(encode("json", FLOAT_DATA))
+    got = json.loads(encode(name, FLOAT_DATA))
+    assert got == expected
+    assert [repr(value) for value in got["floats"]] == [repr(value) for value in expected["floats"]]
+
+
+@pytest.mark.parametrize("name", ENCODERS)
+def test_encoders_give_compact_sorted_utf8(name):
+    assert encode(name, {"b": [1, 2], "a": "Москва"}) == '{"a":"Москва","b":[1,2]}'.encode("utf-8")
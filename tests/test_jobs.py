@@ -0,0 +1,40 @@
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import giftr  # noqa: E402
+from giftr import jobs  # noqa: E402
+from giftr.exceptions import InvalidJSONError  # noqa: E402
+
+"""
+File contains tests of async imports in cases http tests can't make: errors of putting job to the queue (run from tests
+folder, server isn't needed)
+"""
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    settings = tmp_path / "settings.cfg"
+    settings.write_text("SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'\n".format(tmp_path / "gifts.sqlite"))
+    monkeypatch.setenv('GIFTS_SETTINGS', str(settings))
+    app = giftr.create_app()
+    with app.app_context():
+        giftr.db.create_all()
+    return app.test_client()
+
+
+def failing_submit(error):
+    def submit_import(request_json, idempotency_key=None):
+        raise error
+    return submit_import
+
+
+@pytest.mark.parametrize("error, status_code", [(InvalidJSONError("Bad citizens"), 400),
+                                                (RuntimeError("cannot schedule new futures after shutdown"), 500)])
+def test_async_submit_errors(client, monkeypatch, error, status_code):
+    monkeypatch.setattr(jobs, "submit_import", failing_submit(error))
+    r = client.post('/imports?async=1', json={"citizens": []})
+    assert r.status_code == status_code
+    assert r.get_data(as_text=True) == "Insertion failed: {}".format(error)
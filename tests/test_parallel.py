@@ -0,0 +1,113 @@
+import sys
+import os
+import copy
+import multiprocessing
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import help_data, parallel  # noqa: E402
+from giftr.exceptions import BadFormatError  # noqa: E402
+from test import get_test_file_as_structure  # noqa: E402
+
+"""
+File contains tests of parallel unpacking of citizens sets: it has to give the same data and the same errors as
+serial one (run from tests folder, server isn't needed)
+"""
+
+PROCESSES = 3
+
+# sets are repeated to give every process a shard
+GOOD_SETS = ['test_files/good_data_set1.test', 'test_files/good_and_big_set.test']
+BAD_SETS = [
+    # bad date
+    'test_files/simple_set_date_with_whitespaces.test',
+    'test_files/simple_set_with_rubbish_in_place_of_date.test',
+    # unknown relative
+    'test_files/simple_absent_relatives_set.test',
+    'test_files/data_set_with_absent_relatives1.test',
+    # non-mutual relative
+    'test_files/simple_inconsistent_relatives_set.test',
+    'test_files/data_set_with_inconsistent_relatives1.test',
+    # the same relative twice
+    'test_files/simple_set_with_non_unique_relatives.test',
+]
+
+
+@pytest.fixture(scope="module")
+def app_context(request):
+    # workers of pool aren't left after tests
+    request.addfinalizer(parallel.shutdown)
+    app = Flask(__name__)
+    with app.app_context():
+        yield
+
+
+def unpack_serial(citizens):
+    """
+    Unpack citizens in this process (result or exception)
+    """
+    try:
+        return help_data.get_insert_data({"citizens": copy.deepcopy(citizens)})
+    except BadFormatError as e:
+        return e
+
+
+def unpack_parallel(citizens):
+    """
+    Unpack citizens in pool of processes (result or exception)
+    """
+    try:
+        return help_data.get_insert_data_parallel(copy.deepcopy(citizens), PROCESSES)
+    except BadFormatError as e:
+        return e
+
+
+@pytest.mark.parametrize("data_file", GOOD_SETS)
+def test_parallel_good_set(app_context, data_file):
+    citizens = get_test_file_as_structure(data_file)["citizens"]
+    serial = unpack_serial(citizens)
+    parallel = unpack_parallel(citizens)
+    assert not isinstance(serial, BadFormatError)
+    assert parallel == serial
+
+
+@pytest.mark.parametrize("data_file", BAD_SETS)
+def test_parallel_bad_set(app_context, data_file):
+    citizens = get_test_file_as_structure(data_file)["citizens"]
+    serial = unpack_serial(citizens)
+    parallel = unpack_parallel(citizens)
+    assert isinstance(serial, BadFormatError)
+    assert type(parallel) is type(serial)
+    assert parallel.value == serial.value
+
+
+def test_parallel_error_in_the_last_shard(app_context):
+    # errors of dates are found before errors of relatives whatever shard they are in
+    citizens = get_test_file_as_structure('test_files/good_and_big_set.test')["citizens"]
+    citizens[0]["relatives"].append(citizens[-1]["citizen_id"])
+    citizens[-1]["birth_date"] = "31.02.2000"
+    serial = unpack_serial(citizens)
+    parallel = unpack_parallel(citizens)
+    assert isinstance(serial, BadFormatError)
+    assert type(parallel) is type(serial)
+    assert parallel.value == serial.value
+
+
+def test_shutdown_stops_workers(app_context):
+    assert parallel.map_shards(len, list(range(10)), PROCESSES) == [4, 4, 2]
+    assert multiprocessing.active_children()
+    parallel.shutdown()
+    assert not multiprocessing.active_children()
+    # pool is created again when it is needed
+    assert parallel.map_shards(len, list(range(10)), PROCESSES) == [4, 4, 2]
+
+
+def test_python_executable_under_uwsgi(monkeypatch):
+    # uwsgi binary can't run spawned processes - python of the same environment is used
+    monkeypatch.setattr(sys, "executable", "/usr/local/bin/uwsgi")
+    executable = parallel.python_executable()
+    assert os.path.basename(executable).startswith("python")
+    assert executable.startswith(sys.prefix)
+    assert parallel.python_executable("/opt/venv/bin/python3") == "/opt/venv/bin/python3"
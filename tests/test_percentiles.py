@@ -0,0 +1,40 @@
+import sys
+import os
+import random
+import datetime
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import percentiles  # noqa: E402
+
+"""
+File contains tests of vectorized percentiles: they have to be exactly the same as numpy.percentile gives for every
+town (numpy 1.22 and newer, run from tests folder, server isn't needed)
+"""
+
+TODAY = datetime.date(2019, 8, 30)
+
+
+def numpy_percentiles(towns, birth_dates, counts):
+    ages = dict()
+    for town, birth_date, citizens in zip(towns, birth_dates, counts):
+        age = TODAY.year - birth_date.year - ((TODAY.month, TODAY.day) < (birth_date.month, birth_date.day))
+        ages.setdefault(town, []).extend([age] * citizens)
+    return [(town, list(numpy.percentile(ages[town], percentiles.PERCENTS))) for town in sorted(ages)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_town_percentiles_as_numpy(seed):
+    # many tiny towns - for some of them interpolation of numpy differs from a + (b - a) * t in the last digits
+    rng = random.Random(seed)
+    start = datetime.date(1930, 1, 1).toordinal()
+    towns, birth_dates, counts = list(), list(), list()
+    for town in range(2000):
+        for _ in range(rng.randrange(1, 10)):
+            towns.append("Город {}".format(town))
+            birth_dates.append(datetime.date.fromordinal(rng.randint(start, TODAY.toordinal())))
+            counts.append(rng.randint(1, 2))
+    got = percentiles.town_percentiles(towns, birth_dates, counts, today=TODAY)
+    assert [(town, list(values)) for town, values in got] == numpy_percentiles(towns, birth_dates, counts)
@@ -0,0 +1,134 @@
+import sys
+import os
+
+import pytest
+from flask import Flask
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import registry  # noqa: E402
+from giftr.models import db, Imports  # noqa: E402
+
+"""
+File contains tests of registry of sets in cases http tests can't make: imports of other processes committed out of
+order, number of queries for sets that don't exist (run from tests folder, server isn't needed)
+"""
+
+WINDOW = 2
+
+
+@pytest.fixture
+def app_context():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['IMPORT_REGISTRY_WINDOW'] = WINDOW
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield
+
+
+@pytest.fixture
+def queries(app_context):
+    # statements sent to db
+    statements = list()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    engine = db.get_engine()
+    event.listen(engine, "before_cursor_execute", count)
+    yield statements
+    event.remove(engine, "before_cursor_execute", count)
+
+
+def commit_import(import_id, citizens_count):
+    # import of other process - registry of this one doesn't know about it
+    db.session.add(Imports(import_id=import_id, citizens_count=citizens_count))
+    db.session.commit()
+
+
+def test_registry_finds_imports_of_other_processes(app_context):
+    for import_id in range(1, 11):
+        commit_import(import_id, 5)
+    assert registry.find("10") == 10
+    assert registry.find(11) is None
+
+
+def test_registry_finds_import_committed_out_of_order(app_context, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(registry.time, "monotonic", lambda: now[0])
+    for import_id in range(1, 11):
+        if import_id != 3:
+            commit_import(import_id, 5)
+    assert registry.find(10) == 10
+    assert registry.find(3) is None
+    # import 3 started before the others and committed after them - far behind the window
+    commit_import(3, 7)
+    # miss of it is remembered for a while
+    assert registry.find(3) is None
+    now[0] += 2
+    assert registry.find(3) == 3
+    assert registry.get_registry().citizens_count(3) == 7
+    registry.check_exists("3")
+
+
+def test_registry_empty_and_unknown_imports(app_context):
+    commit_import(1, 0)
+    for import_id in (1, 0, 2, "abc", "-1"):
+        assert registry.find(import_id) is None
+
+
+def test_registry_repeated_misses_make_no_queries(queries, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(registry.time, "monotonic", lambda: now[0])
+    for import_id in range(1, 11):
+        commit_import(import_id, 5)
+    assert registry.find(10) == 10
+    del queries[:]
+    # not positive integers are rejected without queries
+    for import_id in ("abc", "-1", "0", 0):
+        assert registry.find(import_id) is None
+    assert queries == []
+    # the first miss of unknown id costs one query, repeated ones - none
+    for import_id in (3000, 2000):
+        assert registry.find(import_id) is None
+        assert len(queries) == 1
+        for _ in range(10):
+            assert registry.find(import_id) is None
+        assert len(queries) == 1
+        del queries[:]
+
+
+def test_registry_misses_expire(queries, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(registry.time, "monotonic", lambda: now[0])
+    commit_import(1, 5)
+    assert registry.find(1) == 1
+    assert registry.find(2) is None
+    # import of other process committed - it is seen when miss expires
+    commit_import(2, 5)
+    assert registry.find(2) is None
+    now[0] += 2
+    del queries[:]
+    assert registry.find(2) == 2
+    assert len(queries) == 1
+
+
+def test_registry_misses_forgotten_when_greater_set_is_known(app_context, monkeypatch):
+    monkeypatch.setattr(registry.time, "monotonic", lambda: 1000.0)
+    commit_import(1, 5)
+    assert registry.find(3) is None
+    commit_import(3, 5)
+    # set of this process with greater id
+    commit_import(4, 5)
+    registry.get_registry().add(4, 5)
+    assert registry.find(3) == 3
+
+
+def test_registry_misses_bounded(app_context, monkeypatch):
+    monkeypatch.setattr(registry.time, "monotonic", lambda: 1000.0)
+    commit_import(1, 5)
+    for import_id in range(100, 3000):
+        assert registry.find(import_id) is None
+    assert len(registry.get_registry()._missing) == 1024
@@ -0,0 +1,129 @@
+import sys
+import os
+import copy
+
+import jsonschema
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from giftr import help_data, validators  # noqa: E402
+
+"""
+File contains tests of compiled validators against jsonschema on schemas of the application: both have to accept and
+reject the same payloads and report the same problem on the same field (run from tests folder, server isn't needed)
+"""
+
+CITIZEN = {"citizen_id": 1, "town": "Москва", "street": "Льва Толстого", "building": "16к7стр5", "apartment": 7,
+           "name": "Иванов Иван Иванович", "birth_date": "26.12.1986", "gender": "male", "relatives": [2]}
+RELATIVE = dict(CITIZEN, citizen_id=2, gender="female", relatives=[1])
+
+
+def citizens_set(**changes):
+    """
+    Make valid citizens set with changed second citizen (value None of change removes the key)
+    """
+    relative = dict(RELATIVE)
+    for key, value in changes.items():
+        if value is None:
+            relative.pop(key)
+        else:
+            relative[key] = value
+    return {"citizens": [copy.deepcopy(CITIZEN), relative]}
+
+
+INSERT_CASES = [
+    citizens_set(),
+    # wrong types
+    [],
+    {"citizens": {}},
+    {"citizens": [1]},
+    citizens_set(citizen_id="2"),
+    citizens_set(citizen_id=2.5),
+    citizens_set(citizen_id=True),
+    citizens_set(apartment=None, name=None),
+    citizens_set(apartment=7.0),
+    citizens_set(town=1),
+    citizens_set(relatives=1),
+    citizens_set(relatives=[1, "2"]),
+    citizens_set(gender="unknown"),
+    citizens_set(gender=1),
+    # missing keys
+    {},
+    citizens_set(citizen_id=None),
+    citizens_set(relatives=None),
+    citizens_set(birth_date=None),
+    # extra keys
+    dict(citizens_set(), extra=1),
+    citizens_set(age=33),
+    citizens_set(age=33, height=180),
+    # bad dates (format of date strings is checked after validation, so such dates pass both)
+    citizens_set(birth_date=26121986),
+    citizens_set(birth_date=[26, 12, 1986]),
+    citizens_set(birth_date="31.02.2019"),
+    citizens_set(birth_date=""),
+]
+
+PATCH_CASES = [
+    {"name": "Иванова Мария Леонидовна"},
+    {"relatives": [], "town": "Керчь"},
+    # wrong types
+    [],
+    {"apartment": "7"},
+    {"relatives": [1, None]},
+    {"gender": "other"},
+    # missing keys
+    {},
+    # extra keys
+    {"citizen_id": 3},
+    {"name": "Иванова Мария Леонидовна", "age": 33},
+    # bad dates
+    {"birth_date": 26121986},
+    {"birth_date": None},
+    {"birth_date": "32.13.2019"},
+]
+
+
+def jsonschema_errors(schema, instance):
+    """
+    All errors jsonschema finds in instance as (message, path) pairs
+    """
+    validator = jsonschema.validators.validator_for(schema)(schema)
+    return [(error.message, list(error.absolute_path)) for error in validator.iter_errors(instance)]
+
+
+def compiled_error(schema, instance):
+    """
+    Error compiled validator finds in instance as (message, path) pair or None if instance is valid
+    """
+    try:
+        validators.compile_schema(schema)(instance)
+    except validators.ValidationError as e:
+        return e.message, e.path
+    return None
+
+
+@pytest.mark.parametrize("schema, instance", [(help_data.schema_input, instance) for instance in INSERT_CASES] +
+                                             [(help_data.schema_patch, instance) for instance in PATCH_CASES])
+def test_compiled_validator_as_jsonschema(schema, instance):
+    expected = jsonschema_errors(schema, instance)
+    got = compiled_error(schema, instance)
+    if not expected:
+        assert got is None
+        return
+    assert got is not None
+    # compiled validator stops on the first error - jsonschema finds all of them
+    assert got in expected
+    best_match = jsonschema.exceptions.best_match(jsonschema.validators.validator_for(schema)(schema)
+                                                  .iter_errors(instance))
+    assert got[1] == list(best_match.absolute_path)
+
+
+def test_citizen_validator_as_jsonschema():
+    schema = help_data.schema_input["properties"]["citizens"]["items"]
+    for instance in INSERT_CASES:
+        for citizen in instance.get("citizens", []) if isinstance(instance, dict) else []:
+            expected = jsonschema_errors(schema, citizen)
+            got = compiled_error(schema, citizen)
+            assert (got is None) == (not expected)
+            if expected:
+                assert got in expected